@@ -0,0 +1 @@
+"""离线测试用的模拟接口和基准测试."""
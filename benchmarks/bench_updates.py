@@ -0,0 +1,206 @@
+"""端到端基准测试：更新延迟、事件循环阻塞、每个位置的内存和每小时的状态写入.
+
+使用真实的WeatherData、协调器和传感器，请求发往本地的模拟接口，不需要网络.
+需要安装Home Assistant（aiohttp随之安装）：
+
+    pip install homeassistant
+    python -m benchmarks.bench_updates --locations 1 50 500
+    python -m benchmarks.bench_updates --locations 500 --compact
+
+每一轮更新相当于调度器对所有位置的一次实况请求；模拟时间每轮前进一个按预算计算的
+请求间隔，一小时内的轮数同样按预算计算，由此得到每小时的状态写入次数.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.heweather import CONFIG_OPTIONS
+from custom_components.heweather.api import ENDPOINT_WEATHER_NOW, NOW_ENDPOINTS
+from custom_components.heweather.coordinator import async_get_hub
+from custom_components.heweather.model import WeatherData
+from custom_components.heweather.scheduler import MAX_CONCURRENT_UPDATES
+from custom_components.heweather.sensor import HeweatherCompactSensor, HeweatherWeatherSensor
+
+from .fake_qweather import FakeQWeather
+
+KEY = "benchmark"
+FIRST_LOCATION = 101010100
+
+# 事件循环阻塞的采样间隔
+LOOP_PROBE_INTERVAL = 0.005
+
+
+class CountingSensor(HeweatherWeatherSensor):
+    """不注册到实体平台，只统计本应写入的状态次数."""
+
+    writes = 0
+
+    def async_write_ha_state(self):
+        CountingSensor.writes += 1
+
+
+class CountingCompactSensor(HeweatherCompactSensor):
+    """精简模式的实体，同样只统计写入次数."""
+
+    def async_write_ha_state(self):
+        CountingSensor.writes += 1
+
+
+class LoopMonitor:
+    """按固定间隔睡眠，实际醒来的延迟即事件循环被阻塞的时间."""
+
+    def __init__(self):
+        self.lags: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_PROBE_INTERVAL
+            await asyncio.sleep(LOOP_PROBE_INTERVAL)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _async_round(hub, datas: list[WeatherData]) -> list[float]:
+    """所有位置更新一次，返回每个位置的耗时."""
+    # 模拟时间已经前进，丢弃协调器中按真实时间缓存的结果
+    hub.clear_results()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+
+    async def timed(data):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await data.async_update(endpoints=NOW_ENDPOINTS)
+            except (PermissionError, ConnectionError):
+                pass
+            return time.perf_counter() - start
+
+    return await asyncio.gather(*(timed(data) for data in datas))
+
+
+async def async_benchmark(locations: int, server: FakeQWeather, base_url: str, compact: bool = False) -> dict:
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        hub = async_get_hub(hass)
+        hub.set_base_url(KEY, base_url)
+        await hub.async_load_snapshot()
+        server.clock = time.time()
+        # 批量预警列表按本轮配置的位置生成，第一轮就能请求有预警位置的预警详情
+        server.locations = {str(FIRST_LOCATION + i) for i in range(locations)}
+        requests_before = sum(server.requests.values())
+        CountingSensor.writes = 0
+
+        gc.collect()
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        datas, sensors = [], []
+        for i in range(locations):
+            location = str(FIRST_LOCATION + i)
+            options = [option for option in CONFIG_OPTIONS if option != "rain_start"]
+            data = WeatherData(hass, location, KEY, "allmsg", "1", history=() if compact else options)
+            datas.append(data)
+            if compact:
+                sensors.append(CountingCompactSensor(data, options, location, location, location))
+            else:
+                sensors.extend(CountingSensor(data, option, location, location, location) for option in options)
+        # 实体不注册到平台，直接调用async_added_to_hass订阅数据推送
+        for sensor in sensors:
+            await sensor.async_added_to_hass()
+
+        with LoopMonitor() as monitor:
+            started = time.perf_counter()
+            await _async_round(hub, datas)
+            first_round = time.perf_counter() - started
+            gc.collect()
+            memory_per_location = (tracemalloc.get_traced_memory()[0] - memory_before) / locations
+            tracemalloc.stop()
+
+            # 按预算计算的实况请求间隔，模拟一小时内的更新
+            interval = hub.quota(KEY).interval(ENDPOINT_WEATHER_NOW, locations)
+            rounds_per_hour = max(1, round(3600 / interval))
+            CountingSensor.writes = 0
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(rounds_per_hour):
+                server.advance(interval)
+                latencies.extend(await _async_round(hub, datas))
+            elapsed = time.perf_counter() - started
+
+        for data in datas:
+            data.async_shutdown()
+        await hass.async_stop(force=True)
+
+    return {
+        "locations": locations,
+        "sensors": len(sensors),
+        "first_round_s": round(first_round, 3),
+        "update_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "update_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "round_avg_s": round(elapsed / rounds_per_hour, 3),
+        "loop_block_max_ms": round(max(monitor.lags, default=0) * 1000, 2),
+        "loop_block_p99_ms": round(_percentile(monitor.lags, 0.99) * 1000, 2),
+        "memory_per_location_kb": round(memory_per_location / 1024, 1),
+        "state_writes_per_hour": CountingSensor.writes,
+        "api_calls": sum(server.requests.values()) - requests_before,
+    }
+
+
+async def async_main(args: argparse.Namespace) -> list[dict]:
+    server = FakeQWeather(
+        latency=tuple(args.latency),
+        error_rate=args.error_rate,
+        unauthorized_rate=args.unauthorized_rate,
+        seed=0,
+    )
+    base_url = await server.start()
+    try:
+        return [await async_benchmark(n, server, base_url, args.compact) for n in args.locations]
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--locations", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.02, 0.08), metavar=("MIN", "MAX"))
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0)
+    parser.add_argument("--compact", action="store_true", help="使用精简模式，每个位置一个实体")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+    results = asyncio.run(async_main(args))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    columns = list(results[0])
+    print("  ".join(f"{c:>22}" for c in columns))
+    for result in results:
+        print("  ".join(f"{result[c]!s:>22}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
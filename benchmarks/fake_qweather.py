@@ -0,0 +1,311 @@
+"""本地模拟的和风天气接口，用于离线测试和基准测试.
+
+返回与v7接口格式一致的数据，各位置的数值随观测时间缓慢变化；可以注入延迟、错误和401.
+
+单独运行：
+    python -m benchmarks.fake_qweather --port 8765 --latency 0.02 0.08 --error-rate 0.01 --locations 101010100
+
+然后在集成的选项中把接口地址设为 http://127.0.0.1:8765/v7 .
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import random
+import time
+import zlib
+from collections import Counter
+from collections.abc import Iterable
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+CST = timezone(timedelta(hours=8))
+
+# 使用该key的请求总是返回401
+INVALID_KEY = "invalid"
+
+WEATHER_TEXTS = [("100", "晴"), ("101", "多云"), ("104", "阴"), ("305", "小雨"), ("306", "中雨"), ("400", "小雪")]
+WIND_DIRS = [(0, "北风"), (45, "东北风"), (90, "东风"), (135, "东南风"), (180, "南风"), (225, "西南风"), (270, "西风"), (315, "西北风")]
+AIR_CATEGORIES = [(50, "1", "优"), (100, "2", "良"), (150, "3", "轻度污染"), (200, "4", "中度污染"), (300, "5", "重度污染")]
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, CST).strftime("%Y-%m-%dT%H:%M+08:00")
+
+
+def _seed(location: str) -> float:
+    """每个位置固定的0~1之间的值，决定该位置的气候和是否有预警."""
+    return zlib.crc32(location.encode()) / 2**32
+
+
+class FakeQWeather:
+    """模拟的接口服务器.
+
+    latency为每个请求随机延迟的范围（秒）；error_rate的请求返回502或code 500；
+    unauthorized_rate的请求返回code 401；warning_rate的位置有一条生效的预警.
+    locations为配置的位置ID，批量预警列表从中列出有预警的位置.
+    clock为None时使用真实时间，基准测试可以用advance()推进模拟的时间.
+    """
+
+    def __init__(
+        self,
+        latency: tuple[float, float] = (0.0, 0.0),
+        error_rate: float = 0.0,
+        unauthorized_rate: float = 0.0,
+        warning_rate: float = 0.05,
+        observation_interval: float = 600,
+        seed: int | None = None,
+        locations: Iterable[str] = (),
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.warning_rate = warning_rate
+        self.observation_interval = observation_interval
+        self.clock: float | None = None
+        self.requests: Counter[str] = Counter()
+        self.responses: Counter[str] = Counter()
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self.locations: set[str] = set(locations)
+        self._runner: web.AppRunner | None = None
+        self._builders = {
+            "weather/now": self._weather_now,
+            "air/now": self._air_now,
+            "warning/now": self._warning_now,
+            "warning/list": self._warning_list,
+            "weather/24h": self._weather_24h,
+            "weather/7d": self._weather_7d,
+            "minutely/5m": self._minutely,
+            "grid-weather/now": self._grid_now,
+        }
+
+    def now(self) -> float:
+        return self.clock if self.clock is not None else time.time()
+
+    def advance(self, seconds: float) -> None:
+        self.clock = self.now() + seconds
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """启动服务器，返回接口地址；port为0时使用随机端口."""
+        app = web.Application()
+        app.router.add_get("/v7/{endpoint:.+}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/v7"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        endpoint = request.match_info["endpoint"]
+        self.requests[endpoint] += 1
+        low, high = self.latency
+        if high > 0:
+            await asyncio.sleep(self._random.uniform(low, high))
+        if request.query.get("key") == INVALID_KEY or self._random.random() < self.unauthorized_rate:
+            return self._respond("401", {"code": "401"})
+        if self._random.random() < self.error_rate:
+            if self._random.random() < 0.5:
+                self.responses["502"] += 1
+                return web.Response(status=502, text="Bad Gateway")
+            return self._respond("500", {"code": "500"})
+        if (builder := self._builders.get(endpoint)) is None:
+            return self._respond("404", {"code": "404"})
+        location = request.query.get("location") or request.query.get("range") or ""
+        observed = self.now() // self.observation_interval * self.observation_interval
+        return self._respond("200", {
+            "code": "200",
+            "updateTime": _format_time(observed),
+            "fxLink": "https://www.qweather.com",
+            **builder(location, observed),
+            "refer": {"sources": ["QWeather"], "license": ["QWeather Developers License"]},
+        })
+
+    def _respond(self, code: str, body: dict) -> web.Response:
+        self.responses[code] += 1
+        response = web.json_response(body)
+        self.bytes_sent += len(response.body)
+        return response
+
+    def _has_warning(self, location: str) -> bool:
+        return _seed(location) < self.warning_rate
+
+    def _weather(self, location: str, timestamp: float) -> dict:
+        seed = _seed(location)
+        day = 2 * math.pi * (timestamp % 86400) / 86400
+        temp = round(5 + 25 * seed + 6 * math.sin(day - 2))
+        icon, text = WEATHER_TEXTS[int(timestamp // 10800 + seed * 100) % len(WEATHER_TEXTS)]
+        wind360, wind_dir = WIND_DIRS[int(timestamp // 3600 + seed * 100) % len(WIND_DIRS)]
+        humidity = round(40 + 40 * seed + 10 * math.cos(day))
+        return {
+            "temp": str(temp),
+            "feelsLike": str(temp - 2),
+            "icon": icon,
+            "text": text,
+            "wind360": str(wind360),
+            "windDir": wind_dir,
+            "windScale": str(1 + int(seed * 5)),
+            "windSpeed": str(3 + int(seed * 20)),
+            "humidity": str(humidity),
+            "precip": "0.5" if icon.startswith(("3", "4")) else "0.0",
+            "pressure": str(round(1013 + 10 * math.sin(timestamp / 40000 + seed * 10))),
+            "vis": str(5 + int(seed * 25)),
+            "cloud": str(int(seed * 100)),
+            "dew": str(temp - 8),
+        }
+
+    def _weather_now(self, location: str, observed: float) -> dict:
+        return {"now": {"obsTime": _format_time(observed), **self._weather(location, observed)}}
+
+    def _grid_now(self, location: str, observed: float) -> dict:
+        weather = self._weather(location, observed)
+        del weather["feelsLike"], weather["vis"]
+        return {"now": {"obsTime": _format_time(observed), **weather}}
+
+    def _air_now(self, location: str, observed: float) -> dict:
+        # 空气质量每小时发布一次
+        published = observed // 3600 * 3600
+        seed = _seed(location)
+        aqi = round(30 + 150 * seed + 20 * math.sin(published / 20000))
+        level, category = next(((lv, c) for limit, lv, c in AIR_CATEGORIES if aqi <= limit), ("6", "严重污染"))
+        return {"now": {
+            "pubTime": _format_time(published),
+            "aqi": str(aqi),
+            "level": level,
+            "category": category,
+            "primary": "PM2.5" if aqi > 50 else "NA",
+            "pm10": str(round(aqi * 1.2)),
+            "pm2p5": str(round(aqi * 0.7)),
+            "no2": str(round(10 + 30 * seed)),
+            "so2": str(round(2 + 8 * seed)),
+            "co": f"{0.3 + seed:.1f}",
+            "o3": str(round(20 + 60 * seed)),
+        }}
+
+    def _warning_now(self, location: str, observed: float) -> dict:
+        if not self._has_warning(location):
+            return {"warning": []}
+        issued = observed // 21600 * 21600
+        return {"warning": [{
+            "id": f"{location}{int(issued)}",
+            "sender": "模拟气象台",
+            "pubTime": _format_time(issued),
+            "title": "模拟气象台发布大风蓝色预警",
+            "startTime": _format_time(issued),
+            "endTime": _format_time(issued + 86400),
+            "status": "active",
+            "severity": "Minor",
+            "severityColor": "Blue",
+            "type": "1006",
+            "typeName": "大风",
+            "urgency": "",
+            "certainty": "",
+            "text": "预计未来24小时内有6级以上大风，请注意防范。",
+            "related": "",
+        }]}
+
+    def _warning_list(self, location: str, observed: float) -> dict:
+        # 与真实接口一样，列表与请求过哪些位置无关
+        return {"warningLocList": [
+            {"locationId": loc} for loc in sorted(self.locations) if self._has_warning(loc)
+        ]}
+
+    def _weather_24h(self, location: str, observed: float) -> dict:
+        start = observed // 3600 * 3600 + 3600
+        hourly = []
+        for i in range(24):
+            timestamp = start + i * 3600
+            weather = self._weather(location, timestamp)
+            hourly.append({
+                "fxTime": _format_time(timestamp),
+                **{k: weather[k] for k in (
+                    "temp", "icon", "text", "wind360", "windDir", "windScale", "windSpeed",
+                    "humidity", "precip", "pressure", "cloud", "dew"
+                )},
+                "pop": "60" if weather["icon"].startswith(("3", "4")) else "5",
+            })
+        return {"hourly": hourly}
+
+    def _weather_7d(self, location: str, observed: float) -> dict:
+        daily = []
+        for i in range(7):
+            timestamp = observed + i * 86400
+            noon = self._weather(location, timestamp // 86400 * 86400 + 6 * 3600)
+            night = self._weather(location, timestamp // 86400 * 86400 + 20 * 3600)
+            daily.append({
+                "fxDate": datetime.fromtimestamp(timestamp, CST).strftime("%Y-%m-%d"),
+                "tempMax": str(max(int(noon["temp"]), int(night["temp"]))),
+                "tempMin": str(min(int(noon["temp"]), int(night["temp"]))),
+                "iconDay": noon["icon"],
+                "textDay": noon["text"],
+                "iconNight": night["icon"],
+                "textNight": night["text"],
+                "wind360Day": noon["wind360"],
+                "windDirDay": noon["windDir"],
+                "windScaleDay": noon["windScale"],
+                "windSpeedDay": noon["windSpeed"],
+                "humidity": noon["humidity"],
+                "precip": noon["precip"],
+                "pressure": noon["pressure"],
+                "vis": noon["vis"],
+                "cloud": noon["cloud"],
+                "uvIndex": str(1 + int(_seed(location) * 10)),
+            })
+        return {"daily": daily}
+
+    def _minutely(self, location: str, observed: float) -> dict:
+        raining = self._weather(location, observed)["icon"].startswith(("3", "4"))
+        return {
+            "summary": "未来两小时有小雨" if raining else "未来两小时无降水",
+            "minutely": [
+                {
+                    "fxTime": _format_time(observed + i * 300),
+                    "precip": "0.10" if raining and i >= 6 else "0.00",
+                    "type": "rain",
+                }
+                for i in range(24)
+            ],
+        }
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    server = FakeQWeather(
+        latency=tuple(args.latency),
+        error_rate=args.error_rate,
+        unauthorized_rate=args.unauthorized_rate,
+        warning_rate=args.warning_rate,
+        locations=args.locations,
+    )
+    base_url = await server.start(args.host, args.port)
+    print(f"Fake QWeather API at {base_url}, key '{INVALID_KEY}' is always rejected")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.0, 0.0), metavar=("MIN", "MAX"))
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0)
+    parser.add_argument("--warning-rate", type=float, default=0.05)
+    parser.add_argument("--locations", nargs="*", default=[], help="配置的位置ID，用于批量预警列表")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
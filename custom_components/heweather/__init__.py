@@ -1,9 +1,44 @@
+import logging
+from datetime import timedelta
+
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
+import homeassistant.helpers.config_validation as cv
+
+_LOGGER = logging.getLogger(__name__)
 
 DOMAIN = "heweather"
 
+# 配置项的 位置 -> WeatherData
+DATA_WEATHER = "weather_data"
+# 配置项的 追踪器实体 -> GridTracker
+DATA_GRID = "grid"
+
+TIME_BETWEEN_UPDATES = timedelta(seconds=600)
+
+CONF_OPTIONS = "options"
+CONF_LOCATION = "location"
+CONF_KEY = "key"
+CONF_DISASTERLEVEL = "disasterlevel"
+CONF_DISASTERMSG = "disastermsg"
+CONF_NAME = "name"
+CONF_ID = "id"
+CONF_DEADBAND = "deadband"
+CONF_DAILY_BUDGET = "daily_budget"
+CONF_BASE_URL = "base_url"
+CONF_LOCATION_NAME = "location_name"
+# fleet配置项的位置列表和同时请求的位置数
+CONF_LOCATIONS = "locations"
+CONF_CONCURRENCY = "concurrency"
+# 提供格点天气的device_tracker和person实体
+CONF_TRACKERS = "trackers"
+# 精简模式：每个位置只有一个实体，其余类型作为属性
+CONF_COMPACT = "compact"
+
+# 免费版每个key每天的调用次数
+DEFAULT_DAILY_BUDGET = 1000
+
 CONFIG_OPTIONS = {
     "disaster_warn": "灾害预警信息",
     "temprature": "温度",
@@ -27,9 +62,30 @@ CONFIG_OPTIONS = {
     "co": "一氧化碳",
     "so2": "二氧化硫",
     "no2": "二氧化氮",
-    "o3": "臭氧"
+    "o3": "臭氧",
+    "rain_start": "分钟级降水（几分钟后开始下雨）",
+    "heat_index": "酷热指数（本地计算）",
+    "wind_chill": "风寒温度（本地计算）",
+    "absolute_humidity": "绝对湿度（本地计算）",
+    "cloud_base": "云底高度（本地计算）",
+    "aqi_pm25": "PM2.5分指数（本地计算）",
+    "aqi_pm10": "PM10分指数（本地计算）",
+    "aqi_no2": "二氧化氮分指数（本地计算）",
+    "aqi_so2": "二氧化硫分指数（本地计算）",
+    "aqi_co": "一氧化碳分指数（本地计算）",
+    "aqi_o3": "臭氧分指数（本地计算）",
+    "sunrise": "日出（本地计算）",
+    "sunset": "日落（本地计算）",
+    "moon_phase": "月相（本地计算）"
 }
 
+# 可配置变化死区的数值型传感器
+CONFIG_DEADBAND_OPTIONS = [
+    "temprature", "humidity", "feelsLike", "windSpeed", "pressure", "vis",
+    "cloud", "dew", "precip", "qlty", "pm25", "pm10", "co", "so2", "no2", "o3",
+    "heat_index", "wind_chill", "absolute_humidity", "cloud_base"
+]
+
 CONFIG_DISASTER_LEVEL = {
     "1": "标准-Standard",
     "2": "次要-Minor",
@@ -45,12 +101,104 @@ CONFIG_DISASTER_MSG = {
 }
 
 PLATFORMS: list[Platform] = [
-    Platform.SENSOR
+    Platform.SENSOR,
+    Platform.WEATHER
 ]
 
+
+def entry_sites(entry: ConfigEntry) -> list[dict]:
+    """配置项中的位置：fleet配置项为位置列表，普通配置项只有一个位置."""
+    if CONF_LOCATIONS in entry.data:
+        return entry.data[CONF_LOCATIONS]
+    return [{
+        k: entry.data.get(k) for k in (CONF_LOCATION, CONF_NAME, CONF_ID, CONF_LOCATION_NAME)
+    }]
+
+
+# 子模块需要引用上面的常量
+from .api import API_BASE_URL
+from .coordinator import async_get_hub
+from .fleet import FleetGroup, FLEET_CONCURRENCY_DEFAULT
+from .grid import GridTracker, async_get_grid_cache
+from .derived import async_get_derived
+from .location import async_location_coordinates, async_location_point
+from .model import DERIVED, FIELDS, WeatherData
+from .readings import async_get_readings, async_register_api
+
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config) -> bool:
+    # 服务和websocket命令读取所有配置项共用的快照，只注册一次
+    async_register_api(hass)
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     hass.data.setdefault(DOMAIN, {})
-    hass.data[DOMAIN].setdefault(entry.entry_id, {})
+    hub = async_get_hub(hass)
+    await hub.async_load_snapshot()
+
+    # 付费版或本地测试用的服务器使用其它的接口地址
+    hub.set_base_url(entry.data[CONF_KEY], entry.data.get(CONF_BASE_URL, API_BASE_URL))
+
+    group = None
+    if CONF_LOCATIONS in entry.data:
+        # fleet的所有位置共用一个并发限制，一轮更新的状态一起写入；会话由协调器共享
+        group = FleetGroup(hass, entry.data.get(CONF_CONCURRENCY, FLEET_CONCURRENCY_DEFAULT))
+        entry.async_on_unload(group.async_shutdown)
+    budget = entry.data.get(CONF_DAILY_BUDGET, DEFAULT_DAILY_BUDGET)
+    options = entry.data.get(CONF_OPTIONS, [])
+    derived = [o for o in options if FIELDS[o].endpoint == DERIVED]
+    # 精简模式没有趋势传感器，不需要保存历史
+    history = () if entry.data.get(CONF_COMPACT) else options
+    # 已由其它配置项提供的位置和追踪器不再创建，否则实体的unique_id冲突
+    others = [
+        hass.data[DOMAIN][other.entry_id]
+        for other in hass.config_entries.async_entries(DOMAIN)
+        if other.entry_id != entry.entry_id and other.entry_id in hass.data[DOMAIN]
+    ]
+    taken_locations = {location for other in others for location in other[DATA_WEATHER]}
+    taken_trackers = {entity_id for other in others for entity_id in other[DATA_GRID]}
+    weather = {}
+    for site in entry_sites(entry):
+        location = site[CONF_LOCATION]
+        if location in taken_locations or location in weather:
+            _LOGGER.warning(f"Location {location} is already configured, skipped")
+            continue
+        coordinates = None
+        if "rain_start" in options:
+            # 分钟级降水按经纬度请求，坐标取自城市列表
+            coordinates = await async_location_coordinates(hass, location)
+        data = WeatherData(
+            hass, location, entry.data[CONF_KEY],
+            entry.data.get(CONF_DISASTERMSG), entry.data.get(CONF_DISASTERLEVEL),
+            coordinates, history, group
+        )
+        entry.async_on_unload(data.async_shutdown)
+        # 先用上次保存的数据创建实体，不在启动流程中等待网络请求
+        data.async_restore(hub.snapshot(location))
+        weather[location] = data
+        entry.async_on_unload(async_get_readings(hass).async_add(data, site[CONF_NAME]))
+        if derived:
+            # 本地计算的指标不请求接口，日出日落按城市列表中的坐标计算
+            point = None
+            if "sunrise" in derived or "sunset" in derived:
+                point = await async_location_point(hass, location)
+            entry.async_on_unload(async_get_derived(hass).async_add(data, *(point or (None, None))))
+        # 由共享的调度器按每日预算安排请求，首次请求在后台进行
+        entry.async_on_unload(hub.scheduler.async_add(data, budget))
+    # 移动的追踪器按所在网格请求格点天气，同一网格的追踪器共用缓存
+    grid = {}
+    for entity_id in entry.data.get(CONF_TRACKERS, []):
+        if entity_id in taken_trackers:
+            _LOGGER.warning(f"Tracker {entity_id} is already configured, skipped")
+            continue
+        tracker = GridTracker(hass, async_get_grid_cache(hass, entry.data[CONF_KEY]), entity_id)
+        entry.async_on_unload(tracker.async_start())
+        grid[entity_id] = tracker
+    hass.data[DOMAIN][entry.entry_id] = {DATA_WEATHER: weather, DATA_GRID: grid}
+
     entry.async_on_unload(entry.add_update_listener(update_listener))
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     return True
@@ -0,0 +1,104 @@
+"""和风天气 Web API v7 的异步客户端."""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from time import monotonic
+from typing import Any
+
+import aiohttp
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .stats import CODE_CLIENT_ERROR, CODE_TIMEOUT, EndpointStats
+
+_LOGGER = logging.getLogger(__name__)
+
+API_BASE_URL = "https://devapi.qweather.com/v7"
+
+ENDPOINT_WEATHER_NOW = "weather/now"
+ENDPOINT_AIR_NOW = "air/now"
+ENDPOINT_WARNING_NOW = "warning/now"
+
+# 逐小时（24小时）和逐天（7天）预报
+ENDPOINT_FORECAST_HOURLY = "weather/24h"
+ENDPOINT_FORECAST_DAILY = "weather/7d"
+
+# 未来两小时逐5分钟的降水，location参数为"经度,纬度"
+ENDPOINT_MINUTELY = "minutely/5m"
+
+# 按经纬度的格点实况天气，location参数为"经度,纬度"
+ENDPOINT_GRID_NOW = "grid-weather/now"
+
+# 有预警的城市列表，location参数为范围（目前只支持cn）
+ENDPOINT_WARNING_LIST = "warning/list"
+
+NOW_ENDPOINTS = (ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW, ENDPOINT_WARNING_NOW)
+FORECAST_ENDPOINTS = (ENDPOINT_FORECAST_HOURLY, ENDPOINT_FORECAST_DAILY)
+
+# 各接口表示位置的参数名
+ENDPOINT_LOCATION_PARAM = {
+    ENDPOINT_WARNING_LIST: "range",
+}
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=20)
+
+
+class QWeatherApiError(ConnectionError):
+    """接口返回了非200的状态码，或者请求失败."""
+
+    def __init__(self, endpoint: str, code: str | None = None):
+        super().__init__(f"{endpoint}: {code}")
+        self.endpoint = endpoint
+        self.code = code
+
+
+class QWeatherClient:
+    """复用Home Assistant共享的连接池访问和风天气接口."""
+
+    def __init__(self, hass: HomeAssistant, key: str, base_url: str = API_BASE_URL):
+        self._session = async_get_clientsession(hass)
+        self._key = key
+        self._base_url = base_url.rstrip("/")
+
+    async def async_get(self, endpoint: str, stats: EndpointStats | None = None, **params) -> dict[str, Any]:
+        """请求单个接口，返回完整的json数据；stats不为None时记录延迟、状态码和流量.
+
+        key无效时抛出PermissionError，其它失败抛出QWeatherApiError.
+        """
+        params["key"] = self._key
+        start = monotonic()
+        try:
+            async with self._session.get(
+                f"{self._base_url}/{endpoint}",
+                params=params,
+                headers={"Accept-Encoding": "gzip"},
+                timeout=REQUEST_TIMEOUT,
+            ) as response:
+                body = await response.read()
+                # 压缩传输时按线上的字节数统计
+                size = response.content_length or len(body)
+            json_data = json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            code = CODE_TIMEOUT if isinstance(e, asyncio.TimeoutError) else CODE_CLIENT_ERROR
+            if stats is not None:
+                stats.record(monotonic() - start, code)
+            # 异常的描述可能带有含key的URL，日志中只记录类型
+            _LOGGER.debug("Error while accessing %s: %s", endpoint, type(e).__name__)
+            raise QWeatherApiError(endpoint, code) from None
+        if not isinstance(json_data, dict):
+            # 合法的json但不是对象，如null、列表或代理返回的错误
+            if stats is not None:
+                stats.record(monotonic() - start, CODE_CLIENT_ERROR, size)
+            _LOGGER.debug("Error while accessing %s: unexpected %s", endpoint, type(json_data).__name__)
+            raise QWeatherApiError(endpoint, CODE_CLIENT_ERROR)
+        code = json_data.get("code")
+        if stats is not None:
+            stats.record(monotonic() - start, str(code), size)
+        if code in ("401", "403"):
+            raise PermissionError(endpoint)
+        if code != "200":
+            raise QWeatherApiError(endpoint, code)
+        return json_data
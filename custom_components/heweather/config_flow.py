@@ -2,9 +2,8 @@
 from __future__ import annotations
 
 import logging
+import zlib
 from typing import Any
-import requests
-import csv
 
 import voluptuous as vol
 
@@ -12,62 +11,64 @@ from homeassistant import config_entries
 from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers import selector
 
 _LOGGER = logging.getLogger(__name__)
 
 from . import DOMAIN
-from . import CONFIG_OPTIONS, CONFIG_DISASTER_LEVEL, CONFIG_DISASTER_MSG
-from .sensor import WeatherData
-
-def _handle_node(dic: dict, *args) -> tuple[str | dict, str]:
-    paths, names = args[:3], args[3:]
-    p, n = dic, ""
-    for i in range(l := len(paths)):
-        if names:
-            p.setdefault(paths[i], {
-                "name": names[i],
-                "c": {} if i < l - 1 else names[l]
-            })
-        p, n = p[paths[i]]["c"], p[paths[i]]["name"]
-    return p, n
-
-def _get_location_data() -> dict:
-    dic = {}
-    url = "https://raw.githubusercontent.com/qwd/LocationList/master/China-City-List-latest.csv"
-    for row in csv.reader(requests.get(url).text.splitlines()):
-        if not (province := row[6]) or province == 'Adm1_Name_EN':
-            continue
-        _handle_node(dic, province, row[8], row[1], row[7], row[9], row[2], row[0])
-    return dic
-
-def _get_dict_map(dic: dict, value="name") -> dict:
-    return {
-        k: v.get(value, "") 
-        for k, v in dic.items() 
-        if isinstance(v, dict)
-    }
+from . import CONFIG_OPTIONS, CONFIG_DISASTER_LEVEL, CONFIG_DISASTER_MSG, CONFIG_DEADBAND_OPTIONS
+from . import DEFAULT_DAILY_BUDGET, CONF_LOCATIONS, CONF_CONCURRENCY, CONF_TRACKERS, entry_sites
+from .sensor import parse_deadband
+from .fleet import FLEET_CONCURRENCY_DEFAULT, FLEET_CONCURRENCY_MAX, parse_location_ids, read_location_file
+from .api import API_BASE_URL, ENDPOINT_WEATHER_NOW, QWeatherClient
+from .coordinator import async_get_hub
+from .location import async_get_location_index, async_nearest_location
+
+SEARCH_LIMIT = 20
+NEAREST_LIMIT = 10
+# fleet中找不到的位置ID最多列出的个数
+FLEET_MISSING_LIMIT = 10
+
+_CONCURRENCY_SCHEMA = vol.All(vol.Coerce(int), vol.Range(min=1, max=FLEET_CONCURRENCY_MAX))
 
-async def _check_api_key(hass, key) -> str:
-    data = WeatherData(hass, "101010100", key, "allmsg", "1")
+async def _check_api_key(hass, key, base_url=None) -> str:
+    hub = async_get_hub(hass)
     try:
-        await data.async_update()
-    except PermissionError as e:
-        return "api_key_error" 
-    except ConnectionError as e:
-        return "unknown_error" 
+        if base_url is None or base_url == hub.base_url(key):
+            # 只需要请求一个接口，且与同一位置的其它请求合并
+            await hub.async_fetch(key, "101010100", ENDPOINT_WEATHER_NOW)
+        else:
+            # 修改了接口地址时用临时的客户端校验，保存后配置项重载时才切换正在使用的客户端
+            hub.quota(key).record()
+            await QWeatherClient(hass, key, base_url).async_get(ENDPOINT_WEATHER_NOW, location="101010100")
+    except PermissionError:
+        return "api_key_error"
+    except ConnectionError:
+        return "unknown_error"
     return ""
 
 
+def _configured_locations(hass) -> set[str]:
+    """所有配置项（包括fleet）中已有的位置，同一位置只能出现在一个配置项中."""
+    return {
+        site["location"]
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        for site in entry_sites(entry)
+    }
+
+
 class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
     
     def __init__(self) -> None:
         super().__init__()
-        self.__area_data = {}
+        self._index = None
         self._api_input = None
         self._city_input = None 
         self._district_input = None
+        self._last_query = None
+        self._nearest = None
 
     @staticmethod
     @callback
@@ -78,7 +79,16 @@ class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Handle the initial step."""
-        self.__area_data = await self.hass.async_add_executor_job(_get_location_data)
+        try:
+            self._index = await async_get_location_index(self.hass)
+            # 预先找到离Home Assistant所在位置最近的地区，用于默认选中
+            nearest = await async_nearest_location(
+                self.hass, self.hass.config.latitude, self.hass.config.longitude
+            )
+        except ConnectionError:
+            # 城市列表还没有下载成功，稍后重新添加时会再次下载
+            return self.async_abort(reason="location_list_unavailable")
+        self._nearest = nearest[0][0] if nearest else None
         return await self.async_step_api(user_input)
 
     async def async_step_api(
@@ -87,11 +97,16 @@ class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         errors = {}
         if user_input is None:
             user_input = {}
-        if "province" in user_input and "api_key" in user_input:
-            if not (err := await _check_api_key(self.hass, api_key := user_input["api_key"])):
+        if "api_key" in user_input:
+            if not (err := await _check_api_key(self.hass, user_input["api_key"])):
                 self._api_input = user_input
-                _LOGGER.info(f'valid api key: {api_key}')
-                return await self.async_step_city(user_input)
+                _LOGGER.info('valid api key')
+                if user_input.get("fleet"):
+                    return await self.async_step_fleet()
+                # 选择了省份时逐级选择省市区，否则按搜索词（留空时按距离）搜索
+                if user_input.get("province"):
+                    return await self.async_step_city(user_input)
+                return await self.async_step_search({"query": user_input.get("query", "")})
             errors["base"] = err
             _LOGGER.error(errors)
         data_schema = {
@@ -99,7 +114,12 @@ class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             vol.Required("options", default=user_input.get("options", vol.UNDEFINED)): cv.multi_select(CONFIG_OPTIONS),
             vol.Required("disasterlevel", default=user_input.get("disasterlevel", "3")): vol.In(CONFIG_DISASTER_LEVEL),
             vol.Required("disastermsg", default=user_input.get("disastermsg", "allmsg")): vol.In(CONFIG_DISASTER_MSG),
-            vol.Required("province", default=user_input.get("province", vol.UNDEFINED)): vol.In(_get_dict_map(self.__area_data))
+            vol.Optional("query", default=user_input.get("query", "")): str,
+            vol.Optional("province", default=user_input.get("province", vol.UNDEFINED)): vol.In(
+                await self.hass.async_add_executor_job(self._index.provinces)
+            ),
+            vol.Optional("fleet", default=user_input.get("fleet", False)): bool,
+            vol.Optional("compact", default=user_input.get("compact", False)): bool
         }
         return self.async_show_form(
             step_id="api",
@@ -115,9 +135,12 @@ class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         if "city" in user_input:
             self._city_input = user_input
             return await self.async_step_district(user_input)
-        city_dic, province_name = _handle_node(self.__area_data, user_input["province"])
+        province_name = (await self.hass.async_add_executor_job(self._index.provinces))[user_input["province"]]
+        cities = await self.hass.async_add_executor_job(self._index.cities, user_input["province"])
         data_schema = {
-            vol.Required("city", default=user_input.get("city", vol.UNDEFINED)): vol.In(_get_dict_map(city_dic))
+            vol.Required("city", default=user_input.get("city", self._nearest_default(
+                "adm2_en", adm1_en=user_input["province"]
+            ))): vol.In(cities)
         }
         return self.async_show_form(
             step_id="city",
@@ -131,30 +154,26 @@ class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     async def async_step_district(
             self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
+        errors = {}
         if user_input is None:
             user_input = {}
-        _, province_name = _handle_node(self.__area_data, province := self._api_input["province"])
-        district_dic, city_name = _handle_node(self.__area_data, province, city := self._city_input["city"])
+        province, city = self._api_input["province"], self._city_input["city"]
+        province_name = (await self.hass.async_add_executor_job(self._index.provinces)).get(province, province)
+        city_name = (await self.hass.async_add_executor_job(self._index.cities, province)).get(city, city)
         if "district" in user_input:
-            location, district_name = _handle_node(self.__area_data, province, city, district := user_input["district"])
-            _LOGGER.info(f"Get location id: {location}, {province}-{city}-{district}")
-            await self.async_set_unique_id(location)
-            self._abort_if_unique_id_configured()
-            return self.async_create_entry(
-                title=f"{district}-{city}",
-                data={
-                    "location": location,
-                    "name": f"{city_name}{district_name}",
-                    "id": f"{district}_{city}".lower().replace(" ", "_").replace("'", "_"),
-                    "key": self._api_input["api_key"],
-                    "disasterlevel": self._api_input["disasterlevel"],
-                    "disastermsg": self._api_input["disastermsg"],
-                    "options": self._api_input["options"],
-                    "location_name": f"{province_name}-{city_name}-{district_name}"
-                },
+            loc = await self.hass.async_add_executor_job(
+                self._index.get, province, city, user_input["district"]
             )
+            if loc is not None:
+                return await self._async_create_location_entry(loc)
+            # 表单打开期间城市列表在后台刷新过，选中的地区已不存在
+            errors["base"] = "location_not_found"
         data_schema = {
-            vol.Required("district", default=user_input.get("district", vol.UNDEFINED)): vol.In(_get_dict_map(district_dic))
+            vol.Required("district", default=user_input.get("district", self._nearest_default(
+                "name_en", adm1_en=province, adm2_en=city
+            ))): vol.In(
+                await self.hass.async_add_executor_job(self._index.districts, province, city)
+            )
         }
         return self.async_show_form(
             step_id="district",
@@ -162,14 +181,161 @@ class HeweatherConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             description_placeholders={
                 "tip": f"{province_name}-{city_name}"
             },
-            errors={}
+            errors=errors
+        )
+
+    async def async_step_search(
+            self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """一个搜索框代替省、市、区三级选择."""
+        errors = {}
+        if user_input is None:
+            user_input = {}
+        query = user_input.get("query", "").strip()
+        if (location := user_input.get("location")) and query == self._last_query:
+            loc = await self.hass.async_add_executor_job(self._index.get_by_id, location)
+            if loc is not None:
+                return await self._async_create_location_entry(loc)
+            # 城市列表已刷新或提交了过期的ID，重新搜索
+            errors["base"] = "location_not_found"
+        # 修改了搜索词时重新搜索
+        self._last_query = query
+        matches = await self._async_search(query)
+        if not matches:
+            errors["base"] = "location_not_found"
+        data_schema = {
+            vol.Optional("query", default=query): str,
+            vol.Optional("location", default=matches[0].id if matches else vol.UNDEFINED): vol.In({
+                loc.id: f"{loc.adm1_zh}-{loc.adm2_zh}-{loc.name_zh}"
+                for loc in matches
+            })
+        }
+        return self.async_show_form(
+            step_id="search",
+            data_schema=vol.Schema(data_schema),
+            description_placeholders={
+                "tip": query
+            },
+            errors=errors
+        )
+
+    async def _async_search(self, query: str) -> list:
+        """按搜索词搜索；搜索词为空或为zone实体时，按距离列出最近的地区."""
+        if not query or query.startswith("zone."):
+            if not query:
+                lat, lon = self.hass.config.latitude, self.hass.config.longitude
+            elif (zone := self.hass.states.get(query)) is not None:
+                lat, lon = zone.attributes.get("latitude"), zone.attributes.get("longitude")
+            else:
+                return []
+            return [loc for loc, _ in await async_nearest_location(self.hass, lat, lon, NEAREST_LIMIT)]
+        return await self.hass.async_add_executor_job(self._index.search, query, SEARCH_LIMIT)
+
+    async def async_step_fleet(
+            self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """一个配置项添加多个位置，位置ID直接填写或从配置目录中的文件导入."""
+        errors = {}
+        missing = []
+        configured = []
+        if user_input is None:
+            user_input = {}
+        if "concurrency" in user_input:
+            ids = parse_location_ids(user_input.get("locations", ""))
+            if path := user_input.get("file", "").strip():
+                try:
+                    ids += await self.hass.async_add_executor_job(read_location_file, self.hass.config.path(path))
+                except (OSError, ValueError) as e:
+                    _LOGGER.error(f"Read location file {path} failed: {e}")
+                    errors["file"] = "fleet_file_error"
+            if not errors and not ids:
+                errors["base"] = "fleet_empty"
+            if not errors:
+                ids = list(dict.fromkeys(ids))
+                locs = await self.hass.async_add_executor_job(lambda: [self._index.get_by_id(i) for i in ids])
+                if missing := [i for i, loc in zip(ids, locs) if loc is None]:
+                    errors["locations"] = "fleet_location_unknown"
+                elif configured := [i for i in ids if i in _configured_locations(self.hass)]:
+                    errors["locations"] = "fleet_location_configured"
+                else:
+                    return await self._async_create_fleet_entry(locs, user_input["concurrency"])
+        data_schema = {
+            vol.Optional("locations", default=user_input.get("locations", "")): str,
+            vol.Optional("file", default=user_input.get("file", "")): str,
+            vol.Required("concurrency", default=user_input.get(
+                "concurrency", FLEET_CONCURRENCY_DEFAULT
+            )): _CONCURRENCY_SCHEMA
+        }
+        return self.async_show_form(
+            step_id="fleet",
+            data_schema=vol.Schema(data_schema),
+            description_placeholders={
+                "missing": ", ".join(missing[:FLEET_MISSING_LIMIT]),
+                "configured": ", ".join(configured[:FLEET_MISSING_LIMIT])
+            },
+            errors=errors
         )
 
+    def _nearest_default(self, field: str, **parents):
+        """最近地区位于已选的上级地区内时，作为默认选项."""
+        if self._nearest is None or any(getattr(self._nearest, k) != v for k, v in parents.items()):
+            return vol.UNDEFINED
+        return getattr(self._nearest, field)
+
+    async def _async_create_location_entry(self, loc) -> FlowResult:
+        _LOGGER.info(f"Get location id: {loc.id}, {loc.adm1_en}-{loc.adm2_en}-{loc.name_en}")
+        await self.async_set_unique_id(loc.id)
+        self._abort_if_unique_id_configured()
+        if loc.id in _configured_locations(self.hass):
+            # 已在某个fleet配置项中
+            return self.async_abort(reason="already_configured")
+        return self.async_create_entry(
+            title=f"{loc.name_en}-{loc.adm2_en}",
+            data={
+                **_site(loc),
+                "key": self._api_input["api_key"],
+                "disasterlevel": self._api_input["disasterlevel"],
+                "disastermsg": self._api_input["disastermsg"],
+                "options": self._api_input["options"],
+                "compact": self._api_input.get("compact", False),
+            },
+        )
+
+    async def _async_create_fleet_entry(self, locs, concurrency: int) -> FlowResult:
+        _LOGGER.info(f"Create fleet of {len(locs)} locations")
+        # 同一组位置只能配置一次
+        ids = ",".join(sorted(loc.id for loc in locs))
+        await self.async_set_unique_id(f"fleet_{zlib.crc32(ids.encode()):08x}")
+        self._abort_if_unique_id_configured()
+        return self.async_create_entry(
+            title=f"Fleet: {len(locs)} locations",
+            data={
+                CONF_LOCATIONS: [_site(loc) for loc in locs],
+                CONF_CONCURRENCY: concurrency,
+                "key": self._api_input["api_key"],
+                "disasterlevel": self._api_input["disasterlevel"],
+                "disastermsg": self._api_input["disastermsg"],
+                "options": self._api_input["options"],
+                "compact": self._api_input.get("compact", False),
+            },
+        )
+
+
+def _site(loc) -> dict[str, str]:
+    """配置项中保存的一个位置."""
+    return {
+        "location": loc.id,
+        "name": f"{loc.adm2_zh}{loc.name_zh}",
+        "id": f"{loc.name_en}_{loc.adm2_en}".lower().replace(" ", "_").replace("'", "_"),
+        "location_name": f"{loc.adm1_zh}-{loc.adm2_zh}-{loc.name_zh}"
+    }
+
 
 class HeweatherOptionsFlow(config_entries.OptionsFlow):
 
     def __init__(self, config_entry: config_entries.ConfigEntry):
         self.config_entry = config_entry
+        self._entry_data = None
 
     async def async_step_init(self, user_input=None):
         return await self.async_step_api(self.config_entry.data)
@@ -179,26 +345,22 @@ class HeweatherOptionsFlow(config_entries.OptionsFlow):
         if user_input is None:
             user_input = {}
         if "api_key" in user_input:  # 已输入提交
-            if not (err := await _check_api_key(self.hass, api_key := user_input["api_key"])):
-                _LOGGER.info(f'valid api key: {api_key}, config update...')
-                data = {
-                    "location": self.config_entry.data["location"],
-                    "name": self.config_entry.data["name"],
-                    "id": self.config_entry.data["id"],
+            if not (err := await _check_api_key(
+                self.hass, api_key := user_input["api_key"], user_input["base_url"]
+            )):
+                _LOGGER.info('valid api key, config update...')
+                self._entry_data = {
+                    **self._entry_locations(user_input),
                     "key": api_key,
                     "disasterlevel": user_input["disasterlevel"],
                     "disastermsg": user_input["disastermsg"],
                     "options": user_input["options"],
-                    "location_name": self.config_entry.data["location_name"]
+                    "daily_budget": user_input["daily_budget"],
+                    "base_url": user_input["base_url"],
+                    "trackers": user_input.get("trackers", []),
+                    "compact": user_input.get("compact", False)
                 }
-                self.hass.config_entries.async_update_entry(
-                    self.config_entry,
-                    data=data
-                )
-                return self.async_create_entry(
-                    title=self.config_entry.title,
-                    data=data,
-                )
+                return await self.async_step_deadband()
             # api key错误
             errors["base"] = err
             _LOGGER.error(errors)
@@ -209,13 +371,76 @@ class HeweatherOptionsFlow(config_entries.OptionsFlow):
             vol.Required("api_key", default=api_key): str,
             vol.Required("options", default=user_input.get("options", vol.UNDEFINED)): cv.multi_select(CONFIG_OPTIONS),
             vol.Required("disasterlevel", default=user_input.get("disasterlevel", "3")): vol.In(CONFIG_DISASTER_LEVEL),
-            vol.Required("disastermsg", default=user_input.get("disastermsg", "allmsg")): vol.In(CONFIG_DISASTER_MSG)
+            vol.Required("disastermsg", default=user_input.get("disastermsg", "allmsg")): vol.In(CONFIG_DISASTER_MSG),
+            vol.Required("daily_budget", default=user_input.get("daily_budget", DEFAULT_DAILY_BUDGET)): vol.All(
+                vol.Coerce(int), vol.Range(min=1)
+            ),
+            vol.Required("base_url", default=user_input.get("base_url", API_BASE_URL)): str,
+            vol.Optional("trackers", default=user_input.get(CONF_TRACKERS, [])): selector.EntitySelector(
+                selector.EntitySelectorConfig(domain=["device_tracker", "person"], multiple=True)
+            ),
+            vol.Optional("compact", default=user_input.get("compact", False)): bool
         }
+        if CONF_LOCATIONS in self.config_entry.data:
+            data_schema[vol.Required("concurrency", default=user_input.get(
+                "concurrency", FLEET_CONCURRENCY_DEFAULT
+            ))] = _CONCURRENCY_SCHEMA
+            tip = f"{len(self.config_entry.data[CONF_LOCATIONS])}个位置"
+        else:
+            tip = self.config_entry.data["location_name"]
         return self.async_show_form(
             step_id='api',
             data_schema=vol.Schema(data_schema),
             description_placeholders={
-                "tip": self.config_entry.data["location_name"]
+                "tip": tip
             },
             errors=errors,
-        )
\ No newline at end of file
+        )
+
+    def _entry_locations(self, user_input) -> dict:
+        """选项中不修改的位置信息，fleet配置项还保存并发数."""
+        data = self.config_entry.data
+        if CONF_LOCATIONS in data:
+            return {CONF_LOCATIONS: data[CONF_LOCATIONS], CONF_CONCURRENCY: user_input["concurrency"]}
+        return {k: data[k] for k in ("location", "name", "id", "location_name")}
+
+    async def async_step_deadband(self, user_input=None):
+        """各数值传感器的变化死区，变化不超过死区时不写入状态."""
+        errors = {}
+        options = [o for o in self._entry_data["options"] if o in CONFIG_DEADBAND_OPTIONS]
+        if not options:
+            return self._async_save({})
+        if self._entry_data["compact"]:
+            # 精简模式的实体在任何变化时写入，保留已有的死区配置
+            return self._async_save(self.config_entry.data.get("deadband", {}))
+        if user_input is not None:
+            for option, value in user_input.items():
+                try:
+                    parse_deadband(value)
+                except ValueError:
+                    errors[option] = "deadband_invalid"
+            if not errors:
+                return self._async_save({k: v for k, v in user_input.items() if v.strip()})
+        else:
+            user_input = self.config_entry.data.get("deadband", {})
+        data_schema = {
+            vol.Optional(option, default=user_input.get(option, "")): str
+            for option in options
+        }
+        return self.async_show_form(
+            step_id="deadband",
+            data_schema=vol.Schema(data_schema),
+            errors=errors,
+        )
+
+    @callback
+    def _async_save(self, deadband: dict):
+        data = {**self._entry_data, "deadband": deadband}
+        self.hass.config_entries.async_update_entry(
+            self.config_entry,
+            data=data
+        )
+        return self.async_create_entry(
+            title=self.config_entry.title,
+            data=data,
+        )
@@ -0,0 +1,239 @@
+"""所有配置项共享的请求协调器."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from time import monotonic
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from . import DOMAIN
+from .api import (
+    API_BASE_URL, QWeatherClient, NOW_ENDPOINTS, ENDPOINT_WARNING_LIST, ENDPOINT_MINUTELY, ENDPOINT_LOCATION_PARAM
+)
+from .scheduler import QuotaTracker, UpdateScheduler, FORECAST_INTERVAL
+from .stats import EndpointStats
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_HUB = "hub"
+
+# 同一请求在该时间内的结果直接复用，合并重载、key校验等短时间内的重复请求
+RESULT_TTL = 60
+
+# 预报更新得慢，重载、新增位置等情况下半个更新间隔内的结果直接复用；
+# 不用整个间隔，避免调度器按间隔请求时命中上一次的结果
+ENDPOINT_RESULT_TTL = {
+    endpoint: interval.total_seconds() / 2 for endpoint, interval in FORECAST_INTERVAL.items()
+}
+
+# 有预警的城市列表在一轮更新中共用
+WARNING_LIST_TTL = 300
+
+# 各位置最近一次成功的接口数据保存在.storage中，启动时先用它创建实体
+SNAPSHOT_STORAGE_KEY = f"{DOMAIN}.snapshot"
+SNAPSHOT_STORAGE_VERSION = 1
+SNAPSHOT_SAVE_DELAY = 30
+# 分钟级降水很快就会过期，重启后没有恢复的意义
+SNAPSHOT_EXCLUDED_ENDPOINTS = (ENDPOINT_MINUTELY,)
+# 各key当天已用的调用次数与快照保存在一起，位置ID不会以下划线开头
+QUOTA_SNAPSHOT_KEY = "_quota"
+
+RequestKey = tuple[str, str, str]
+ResultCallback = Callable[[str, dict[str, Any]], None]
+
+
+@callback
+def async_get_hub(hass: HomeAssistant) -> HeweatherHub:
+    """获取（必要时创建）hass.data[DOMAIN]中的协调器."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if (hub := domain_data.get(DATA_HUB)) is None:
+        hub = domain_data[DATA_HUB] = HeweatherHub(hass)
+    return hub
+
+
+class HeweatherHub:
+    """按(key, location, endpoint)合并请求，同一时刻每个请求最多一个在途.
+
+    请求成功后，结果推送给订阅了该(key, location)的所有订阅者.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._clients: dict[str, QWeatherClient] = {}
+        self._base_urls: dict[str, str] = {}
+        self._inflight: dict[RequestKey, asyncio.Task] = {}
+        self._results: dict[RequestKey, tuple[float, dict[str, Any]]] = {}
+        self._subscribers: dict[tuple[str, str], list[ResultCallback]] = {}
+        self._store = Store(hass, SNAPSHOT_STORAGE_VERSION, SNAPSHOT_STORAGE_KEY)
+        self._snapshot: dict[str, dict[str, dict[str, Any]]] | None = None
+        self._snapshot_lock = asyncio.Lock()
+        self._quotas: dict[str, QuotaTracker] = {}
+        # 已加载、还没有对应QuotaTracker的保存的调用次数
+        self._stored_quotas: dict[str, dict[str, Any]] = {}
+        self._stats: dict[tuple[str, str], EndpointStats] = {}
+        self.scheduler = UpdateScheduler(hass, self)
+
+    def client(self, key: str) -> QWeatherClient:
+        if (client := self._clients.get(key)) is None:
+            client = self._clients[key] = QWeatherClient(
+                self._hass, key, self._base_urls.get(key, API_BASE_URL)
+            )
+        return client
+
+    def base_url(self, key: str) -> str:
+        """某个key当前使用的接口地址."""
+        return self._base_urls.get(key, API_BASE_URL)
+
+    @callback
+    def set_base_url(self, key: str, base_url: str) -> None:
+        """某个key使用的接口地址；地址变化时丢弃旧地址的客户端和缓存的结果."""
+        if self.base_url(key) == base_url:
+            return
+        self._base_urls[key] = base_url
+        self._clients.pop(key, None)
+        for request in [r for r in self._results if r[0] == key]:
+            del self._results[request]
+
+    @callback
+    def clear_results(self) -> None:
+        """丢弃所有已完成的结果，之后的请求都会实际发出；在途的请求不受影响."""
+        self._results.clear()
+
+    def quota(self, key: str) -> QuotaTracker:
+        """某个key的每日调用预算，所有经过协调器的请求都会计入."""
+        if (quota := self._quotas.get(key)) is None:
+            quota = self._quotas[key] = QuotaTracker(on_record=self._async_schedule_save)
+            if (stored := self._stored_quotas.pop(key, None)) is not None:
+                quota.restore(stored)
+        return quota
+
+    def endpoint_stats(self, location: str, endpoint: str) -> EndpointStats:
+        """某位置某接口实际发出的请求的统计，合并的请求只计一次."""
+        if (stats := self._stats.get((location, endpoint))) is None:
+            stats = self._stats[(location, endpoint)] = EndpointStats()
+        return stats
+
+    async def async_load_snapshot(self) -> None:
+        """加载上次保存的快照，只加载一次."""
+        async with self._snapshot_lock:
+            if self._snapshot is None:
+                snapshot = await self._store.async_load() or {}
+                self._stored_quotas = snapshot.pop(QUOTA_SNAPSHOT_KEY, {})
+                self._snapshot = snapshot
+                # 加载前已经创建的（如配置流程校验key时）在已用次数上累加
+                for key, quota in self._quotas.items():
+                    if (stored := self._stored_quotas.pop(key, None)) is not None:
+                        quota.restore(stored)
+
+    def _snapshot_data(self) -> dict[str, Any]:
+        return {
+            **self._snapshot,
+            QUOTA_SNAPSHOT_KEY: {
+                **self._stored_quotas, **{key: quota.as_dict() for key, quota in self._quotas.items()}
+            },
+        }
+
+    @callback
+    def _async_schedule_save(self) -> None:
+        # 快照加载之前不保存，避免覆盖上次保存的内容
+        if self._snapshot is not None:
+            self._store.async_delay_save(self._snapshot_data, SNAPSHOT_SAVE_DELAY)
+
+    @callback
+    def snapshot(self, location: str) -> dict[str, dict[str, Any]]:
+        """某位置各接口最近一次成功的数据：endpoint -> {"time": 时间戳, "data": json}."""
+        return (self._snapshot or {}).get(location, {})
+
+    @callback
+    def async_subscribe(self, key: str, location: str, result_callback: ResultCallback) -> Callable[[], None]:
+        """订阅某个位置的请求结果，返回取消订阅的函数."""
+        subscribers = self._subscribers.setdefault((key, location), [])
+        subscribers.append(result_callback)
+
+        @callback
+        def remove_subscriber() -> None:
+            subscribers.remove(result_callback)
+            if not subscribers:
+                self._subscribers.pop((key, location), None)
+
+        return remove_subscriber
+
+    async def async_fetch(
+        self, key: str, location: str, endpoint: str, max_age: float | None = None,
+        result_callback: ResultCallback | None = None
+    ) -> dict[str, Any]:
+        """请求单个接口，合并相同的在途请求和max_age秒内完成的请求.
+
+        复用已完成的结果时不会再推送给订阅者，result_callback（如刚订阅的WeatherData）单独收到该结果.
+        """
+        if max_age is None:
+            max_age = ENDPOINT_RESULT_TTL.get(endpoint, RESULT_TTL)
+        request = (key, location, endpoint)
+        if (cached := self._results.get(request)) and monotonic() - cached[0] < max_age:
+            if result_callback is not None:
+                result_callback(endpoint, cached[1])
+            return cached[1]
+        if (task := self._inflight.get(request)) is None:
+            task = self._inflight[request] = self._hass.async_create_task(
+                self._async_do_fetch(request)
+            )
+            task.add_done_callback(lambda t: self._async_fetch_done(request, t))
+        # 某个等待者被取消时不影响其它等待者
+        return await asyncio.shield(task)
+
+    async def async_fetch_many(
+        self, key: str, location: str, endpoints=NOW_ENDPOINTS, locations: dict[str, str] | None = None,
+        result_callback: ResultCallback | None = None
+    ) -> dict[str, dict[str, Any] | Exception]:
+        """并发请求多个接口，每个接口的结果（或异常）互不影响.
+
+        locations中的接口使用其它的位置，如分钟级降水使用经纬度.
+        """
+        locations = locations or {}
+        results = await asyncio.gather(
+            *(
+                self.async_fetch(key, locations.get(endpoint, location), endpoint, result_callback=result_callback)
+                for endpoint in endpoints
+            ),
+            return_exceptions=True,
+        )
+        return dict(zip(endpoints, results))
+
+    async def async_warning_locations(self, key: str) -> set[str]:
+        """当前有预警的城市ID，所有位置共用一次批量请求."""
+        json_data = await self.async_fetch(key, "cn", ENDPOINT_WARNING_LIST, WARNING_LIST_TTL)
+        return {item["locationId"] for item in json_data.get("warningLocList", [])}
+
+    async def _async_do_fetch(self, request: RequestKey) -> dict[str, Any]:
+        key, location, endpoint = request
+        self.quota(key).record()
+        json_data = await self.client(key).async_get(
+            endpoint,
+            self.endpoint_stats(location, endpoint),
+            **{ENDPOINT_LOCATION_PARAM.get(endpoint, "location"): location}
+        )
+        self._results[request] = (monotonic(), json_data)
+        if endpoint != ENDPOINT_WARNING_LIST:
+            self.async_publish(key, location, endpoint, json_data)
+        return json_data
+
+    @callback
+    def async_publish(self, key: str, location: str, endpoint: str, json_data: dict[str, Any]) -> None:
+        """保存到快照并推送给订阅者；也用于不需要实际请求就能确定的结果."""
+        if self._snapshot is not None and endpoint not in SNAPSHOT_EXCLUDED_ENDPOINTS:
+            self._snapshot.setdefault(location, {})[endpoint] = {"time": time.time(), "data": json_data}
+            self._async_schedule_save()
+        for result_callback in list(self._subscribers.get((key, location), ())):
+            result_callback(endpoint, json_data)
+
+    @callback
+    def _async_fetch_done(self, request: RequestKey, task: asyncio.Task) -> None:
+        self._inflight.pop(request, None)
+        if not task.cancelled():
+            # 所有等待者都被取消时，避免"exception was never retrieved"
+            task.exception()
@@ -0,0 +1,234 @@
+"""由已有数据本地计算的指标，不额外请求接口.
+
+体感类指标和空气质量分指数取自实况天气和空气质量，日出、日落和月相按位置的经纬度和日期计算.
+一轮更新中各位置的数据到达后稍等片刻，再对所有有变化的位置统一计算一次.
+"""
+from __future__ import annotations
+
+import logging
+import math
+from bisect import bisect_right
+from collections.abc import Callable
+from datetime import date, datetime, timedelta
+
+from astral import Observer
+from astral.moon import phase as moon_phase_days
+from astral.sun import sunrise, sunset
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+import homeassistant.util.dt as dt_util
+
+from . import DOMAIN
+from .api import ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW
+from .model import DERIVED, FIELDS, FIELD_INDEX
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_DERIVED = "derived"
+
+# 数据到达后等待同一轮的其它位置，再统一计算
+DERIVED_DELAY = timedelta(seconds=1)
+
+# 计算所用数据所属的接口
+SOURCE_ENDPOINTS = (ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW)
+
+# 空气质量分指数（HJ 633-2012）：各污染物浓度的分段点，对应IAQI_BREAKPOINTS；
+# PM2.5和PM10使用24小时平均的分段，其余使用1小时平均的分段（SO2超过800后按24小时的分段）
+IAQI_BREAKPOINTS = (0, 50, 100, 150, 200, 300, 400, 500)
+POLLUTANT_BREAKPOINTS = {
+    "aqi_pm25": ("pm25", (0, 35, 75, 115, 150, 250, 350, 500)),
+    "aqi_pm10": ("pm10", (0, 50, 150, 250, 350, 420, 500, 600)),
+    "aqi_no2": ("no2", (0, 100, 200, 700, 1200, 2340, 3090, 3840)),
+    "aqi_so2": ("so2", (0, 150, 500, 650, 800, 1600, 2100, 2620)),
+    "aqi_co": ("co", (0, 5, 10, 35, 60, 90, 120, 150)),
+    "aqi_o3": ("o3", (0, 160, 200, 300, 400, 800, 1000, 1200)),
+}
+
+# 月龄（天）的分段上限 -> 月相，与Home Assistant的moon集成一致
+MOON_PHASES = (
+    (0.5, "new_moon"),
+    (6.5, "waxing_crescent"),
+    (7.5, "first_quarter"),
+    (13.5, "waxing_gibbous"),
+    (14.5, "full_moon"),
+    (20.5, "waning_gibbous"),
+    (21.5, "last_quarter"),
+    (27.5, "waning_crescent"),
+)
+
+
+def heat_index(temperature, humidity):
+    """酷热指数（℃），按美国国家气象局的算法：先用简化公式，较热时改用Rothfusz回归."""
+    if temperature is None or humidity is None:
+        return None
+    t = temperature * 9 / 5 + 32
+    hi = 0.5 * (t + 61 + (t - 68) * 1.2 + humidity * 0.094)
+    if (hi + t) / 2 >= 80:
+        hi = (
+            -42.379 + 2.04901523 * t + 10.14333127 * humidity - 0.22475541 * t * humidity
+            - 6.83783e-3 * t * t - 5.481717e-2 * humidity * humidity
+            + 1.22874e-3 * t * t * humidity + 8.5282e-4 * t * humidity * humidity
+            - 1.99e-6 * t * t * humidity * humidity
+        )
+        if humidity < 13 and 80 <= t <= 112:
+            hi -= (13 - humidity) / 4 * math.sqrt((17 - abs(t - 95)) / 17)
+        elif humidity > 85 and 80 <= t <= 87:
+            hi += (humidity - 85) / 10 * (87 - t) / 5
+    return round((hi - 32) * 5 / 9, 1)
+
+
+def wind_chill(temperature, wind_speed):
+    """风寒温度（℃），适用于10℃以下、风速4.8km/h以上，其余情况即为气温."""
+    if temperature is None or wind_speed is None:
+        return None
+    if temperature > 10 or wind_speed <= 4.8:
+        return temperature
+    v = wind_speed ** 0.16
+    return round(13.12 + 0.6215 * temperature - 11.37 * v + 0.3965 * temperature * v, 1)
+
+
+def absolute_humidity(temperature, humidity):
+    """绝对湿度（g/m³），由气温和相对湿度按Magnus公式计算."""
+    if temperature is None or humidity is None:
+        return None
+    saturation = 6.112 * math.exp(17.67 * temperature / (temperature + 243.5))
+    return round(saturation * humidity * 2.1674 / (273.15 + temperature), 2)
+
+
+def cloud_base(temperature, dew):
+    """对流云的云底高度（米），气温露点差每1℃约125米."""
+    if temperature is None or dew is None:
+        return None
+    return max(0, round((temperature - dew) * 125))
+
+
+def iaqi(concentration, breakpoints):
+    """某污染物的空气质量分指数，超过最高分段时为500."""
+    if concentration is None:
+        return None
+    if concentration >= breakpoints[-1]:
+        return IAQI_BREAKPOINTS[-1]
+    i = bisect_right(breakpoints, concentration) - 1
+    low, high = breakpoints[i], breakpoints[i + 1]
+    return math.ceil(
+        IAQI_BREAKPOINTS[i] + (IAQI_BREAKPOINTS[i + 1] - IAQI_BREAKPOINTS[i]) * (concentration - low) / (high - low)
+    )
+
+
+def moon_phase(day: date) -> str:
+    age = moon_phase_days(day)
+    return next((name for limit, name in MOON_PHASES if age < limit), "new_moon")
+
+
+def _sun_event(event, observer: Observer, day: date) -> datetime | None:
+    """本地日期当天的日出或日落."""
+    try:
+        return event(observer, day, tzinfo=dt_util.DEFAULT_TIME_ZONE)
+    except ValueError:
+        # 极昼或极夜
+        return None
+
+
+@callback
+def async_get_derived(hass: HomeAssistant) -> DerivedMetrics:
+    """获取（必要时创建）hass.data[DOMAIN]中的计算器."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if (derived := domain_data.get(DATA_DERIVED)) is None:
+        derived = domain_data[DATA_DERIVED] = DerivedMetrics(hass)
+    return derived
+
+
+# 各指标在WeatherData.values中的位置
+_HEAT_INDEX = FIELD_INDEX["heat_index"]
+_WIND_CHILL = FIELD_INDEX["wind_chill"]
+_ABSOLUTE_HUMIDITY = FIELD_INDEX["absolute_humidity"]
+_CLOUD_BASE = FIELD_INDEX["cloud_base"]
+_SUNRISE = FIELD_INDEX["sunrise"]
+_SUNSET = FIELD_INDEX["sunset"]
+_MOON_PHASE = FIELD_INDEX["moon_phase"]
+_TEMPERATURE = FIELD_INDEX["temprature"]
+_HUMIDITY = FIELD_INDEX["humidity"]
+_WIND_SPEED = FIELD_INDEX["windSpeed"]
+_DEW = FIELD_INDEX["dew"]
+_IAQI = tuple(
+    (FIELD_INDEX[option], FIELD_INDEX[pollutant], breakpoints)
+    for option, (pollutant, breakpoints) in POLLUTANT_BREAKPOINTS.items()
+)
+DERIVED_INDEXES = tuple(FIELD_INDEX[option] for option, field in FIELDS.items() if field.endpoint == DERIVED)
+
+
+class DerivedMetrics:
+    """所有位置共用的计算器，各位置的结果写入WeatherData.values，按DERIVED通知实体."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        # WeatherData -> (观测者, 日出日落所属的日期)，没有坐标时观测者为None
+        self._locations: dict = {}
+        self._dirty: set = set()
+        self._unsub_compute: CALLBACK_TYPE | None = None
+        self._moon: tuple[date, str] | None = None
+
+    @callback
+    def async_add(self, data, latitude: float | None, longitude: float | None) -> Callable[[], None]:
+        """加入一个位置，返回移除的函数；没有经纬度时不计算日出日落."""
+        observer = Observer(latitude, longitude) if latitude is not None and longitude is not None else None
+        self._locations[data] = [observer, None]
+        unsubs = [
+            data.async_add_listener(self._marker(data), endpoint) for endpoint in SOURCE_ENDPOINTS
+        ]
+        # 已从快照恢复的数据立即计算
+        self._mark(data)
+
+        @callback
+        def remove() -> None:
+            for unsub in unsubs:
+                unsub()
+            self._locations.pop(data, None)
+            self._dirty.discard(data)
+
+        return remove
+
+    def _marker(self, data) -> Callable[[], None]:
+        @callback
+        def mark() -> None:
+            self._mark(data)
+
+        return mark
+
+    @callback
+    def _mark(self, data) -> None:
+        self._dirty.add(data)
+        if self._unsub_compute is None:
+            self._unsub_compute = async_call_later(self._hass, DERIVED_DELAY, self._async_compute)
+
+    @callback
+    def _async_compute(self, now) -> None:
+        self._unsub_compute = None
+        dirty, self._dirty = self._dirty, set()
+        today = dt_util.now().date()
+        if self._moon is None or self._moon[0] != today:
+            # 月相只与日期有关，所有位置共用
+            self._moon = (today, moon_phase(today))
+        moon = self._moon[1]
+        for data in dirty:
+            values = data.values
+            before = [values[i] for i in DERIVED_INDEXES]
+            temperature = values[_TEMPERATURE]
+            humidity = values[_HUMIDITY]
+            values[_HEAT_INDEX] = heat_index(temperature, humidity)
+            values[_WIND_CHILL] = wind_chill(temperature, values[_WIND_SPEED])
+            values[_ABSOLUTE_HUMIDITY] = absolute_humidity(temperature, humidity)
+            values[_CLOUD_BASE] = cloud_base(temperature, values[_DEW])
+            for index, pollutant, breakpoints in _IAQI:
+                values[index] = iaqi(values[pollutant], breakpoints)
+            sun = self._locations[data]
+            if sun[0] is not None and sun[1] != today:
+                # 日出日落每天只算一次
+                sun[1] = today
+                values[_SUNRISE] = _sun_event(sunrise, sun[0], today)
+                values[_SUNSET] = _sun_event(sunset, sun[0], today)
+            values[_MOON_PHASE] = moon
+            if before != [values[i] for i in DERIVED_INDEXES]:
+                data.async_update_listeners(DERIVED)
+        _LOGGER.debug(f"Derived metrics computed for {len(dirty)} locations")
@@ -0,0 +1,65 @@
+"""和风天气的诊断信息，key已脱敏."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from . import DOMAIN, DATA_WEATHER, DATA_GRID, CONF_KEY
+from .api import NOW_ENDPOINTS, FORECAST_ENDPOINTS, ENDPOINT_MINUTELY
+from .coordinator import async_get_hub
+from .grid import async_get_grid_cache
+
+# 格点缓存的cell是约5公里精度的位置，同样需要隐去
+TO_REDACT = {CONF_KEY, "api_key", "cell"}
+
+
+def _location_diagnostics(hub, data) -> dict[str, Any]:
+    requests = {(data.location, endpoint) for endpoint in (*NOW_ENDPOINTS, *FORECAST_ENDPOINTS)}
+    if data.coordinates is not None:
+        requests.add((data.coordinates, ENDPOINT_MINUTELY))
+    return {
+        "endpoints": {
+            endpoint: {
+                "stale": endpoint in data.stale_endpoints,
+                "fetched_at": data.fetched_at.get(endpoint),
+                "observed_at": data.observed_at.get(endpoint),
+                **hub.endpoint_stats(location, endpoint).as_dict(),
+            }
+            for location, endpoint in sorted(requests, key=lambda r: r[1])
+        },
+        "suppressed_writes": data.suppressed_writes,
+    }
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    hub = async_get_hub(hass)
+    weather = hass.data[DOMAIN][entry.entry_id][DATA_WEATHER]
+    grid = hass.data[DOMAIN][entry.entry_id][DATA_GRID]
+    quota = hub.quota(entry.data[CONF_KEY])
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "quota": {
+            "budget": quota.budget,
+            "used_today": quota.used,
+            "remaining": quota.remaining,
+            "exhaustion_time": (exhaustion.isoformat() if (exhaustion := quota.exhaustion_time()) else None),
+        },
+        "circuit_breaker": {
+            "failures": hub.scheduler.breaker.failures,
+            "open_until": hub.scheduler.breaker.open_until,
+        },
+        "locations": {
+            location: _location_diagnostics(hub, data) for location, data in weather.items()
+        },
+        "grid": {
+            "cached_cells": len(cache := async_get_grid_cache(hass, entry.data[CONF_KEY])),
+            "trackers": async_redact_data({
+                entity_id: {"cell": tracker.cell, "observed_at": tracker.observed_at}
+                for entity_id, tracker in grid.items()
+            }, TO_REDACT),
+            **cache.stats.as_dict(),
+        } if grid else None,
+    }
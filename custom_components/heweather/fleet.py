@@ -0,0 +1,96 @@
+"""多位置（fleet）配置项：位置列表的解析、位置间共享的并发限制和合并的状态写入."""
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import logging
+import re
+from datetime import timedelta
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+_LOGGER = logging.getLogger(__name__)
+
+# 同时请求的位置数
+FLEET_CONCURRENCY_DEFAULT = 4
+FLEET_CONCURRENCY_MAX = 32
+
+# 不经过调度器的数据推送（如其它配置项发起的请求）最多等待这么久再写入状态
+FLEET_WRITE_DELAY = timedelta(seconds=2)
+
+_SEPARATORS = re.compile(r"[\s,;，；、]+")
+
+
+def parse_location_ids(text: str) -> list[str]:
+    """以逗号、分号或空白分隔的位置ID，忽略#之后的注释，去重并保持顺序."""
+    ids = []
+    for line in text.splitlines():
+        ids.extend(i for i in _SEPARATORS.split(line.split("#", 1)[0]) if i)
+    return list(dict.fromkeys(ids))
+
+
+def read_location_file(path: str) -> list[str]:
+    """从文件读取位置ID，在executor中调用.
+
+    .json文件为ID的列表，或带locations列表的对象；其它文件按CSV读取每行的第一列，
+    第一列不是数字的行（如表头）被忽略.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            content = json.load(f)
+            if isinstance(content, dict):
+                content = content.get("locations", [])
+            return list(dict.fromkeys(str(i).strip() for i in content if str(i).strip()))
+        rows = csv.reader(line for line in f if not line.lstrip().startswith("#"))
+        return list(dict.fromkeys(
+            row[0].strip() for row in rows if row and row[0].strip().isdigit()
+        ))
+
+
+class FleetGroup:
+    """一个fleet配置项的所有位置共享的并发限制，以及合并的状态写入.
+
+    各位置的数据更新先记下来，调度器的一轮请求结束后一次性通知实体，
+    一轮更新的状态写入集中在同一个回调中，而不是随每个请求分散写入.
+    """
+
+    def __init__(self, hass: HomeAssistant, concurrency: int = FLEET_CONCURRENCY_DEFAULT):
+        self._hass = hass
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # WeatherData -> 待通知的接口
+        self._pending: dict = {}
+        self._unsub_flush: CALLBACK_TYPE | None = None
+
+    @callback
+    def async_schedule(self, data, endpoint: str) -> None:
+        """记下某个位置某个接口的更新，稍后统一通知."""
+        self._pending.setdefault(data, set()).add(endpoint)
+        if self._unsub_flush is None:
+            self._unsub_flush = async_call_later(self._hass, FLEET_WRITE_DELAY, self._async_flush_later)
+
+    @callback
+    def _async_flush_later(self, now) -> None:
+        self._unsub_flush = None
+        self.async_flush()
+
+    @callback
+    def async_flush(self) -> None:
+        """通知所有待通知的更新."""
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        pending, self._pending = self._pending, {}
+        for data, endpoints in pending.items():
+            for endpoint in endpoints:
+                data.async_update_listeners(endpoint)
+        if pending:
+            _LOGGER.debug(f"Flushed updates of {len(pending)} locations")
+
+    @callback
+    def async_shutdown(self) -> None:
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        self._pending.clear()
@@ -0,0 +1,191 @@
+"""移动的device_tracker和person实体所在位置的格点天气.
+
+经纬度量化到固定大小的网格，按网格缓存接口结果：同一网格内的追踪器共用一次请求，
+在网格内的小范围移动不会触发新的请求.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import timedelta
+from time import monotonic
+from typing import Any
+
+from homeassistant.const import ATTR_LATITUDE, ATTR_LONGITUDE
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_state_change_event, async_track_time_interval
+
+from . import DOMAIN
+from .api import ENDPOINT_GRID_NOW
+from .coordinator import async_get_hub
+from .model import FIELDS, _observation_time
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_GRID_CACHES = "grid_caches"
+
+# 网格大小（度），约5公里，与格点天气的分辨率相当
+GRID_CELL_DEGREES = 0.05
+# 网格的结果在该时间内直接复用，追踪器也按该间隔刷新
+GRID_TTL = timedelta(minutes=20)
+# 每个key最多缓存的网格数，超过时淘汰最近最少使用的网格
+GRID_CACHE_SIZE = 256
+# 格点天气的请求统计不区分网格
+GRID_STATS_LOCATION = "grid"
+
+# 格点天气提供的数据项，取值方式与实况天气相同
+GRID_OPTIONS = (
+    "temprature", "humidity", "text", "windDir", "windScale", "windSpeed",
+    "precip", "pressure", "cloud", "dew"
+)
+
+
+def grid_cell(latitude: float, longitude: float) -> str:
+    """经纬度所在网格的中心，格式为接口使用的"经度,纬度"."""
+    def center(value: float) -> float:
+        return (math.floor(value / GRID_CELL_DEGREES) + 0.5) * GRID_CELL_DEGREES
+
+    return f"{center(longitude):.2f},{center(latitude):.2f}"
+
+
+@callback
+def async_get_grid_cache(hass: HomeAssistant, key: str) -> GridCache:
+    """某个key的网格缓存，使用该key的所有追踪器共用."""
+    caches = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_GRID_CACHES, {})
+    if (cache := caches.get(key)) is None:
+        cache = caches[key] = GridCache(hass, async_get_hub(hass), key)
+    return cache
+
+
+class GridCache:
+    """某个key的网格结果缓存：按网格合并在途请求，过期或淘汰后才重新请求."""
+
+    def __init__(self, hass: HomeAssistant, hub, key: str):
+        self._hass = hass
+        self._hub = hub
+        self._key = key
+        self._cells: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.stats = hub.endpoint_stats(GRID_STATS_LOCATION, ENDPOINT_GRID_NOW)
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    async def async_get(self, cell: str) -> dict[str, Any]:
+        """网格的格点天气；没有过期时直接返回缓存，预算用完时返回过期的缓存."""
+        if (cached := self._cells.get(cell)) is not None:
+            if monotonic() - cached[0] < GRID_TTL.total_seconds() or not self._hub.quota(self._key).remaining:
+                self._cells.move_to_end(cell)
+                return cached[1]
+        elif not self._hub.quota(self._key).remaining:
+            raise ConnectionError(f"{ENDPOINT_GRID_NOW}: daily budget exhausted")
+        if (task := self._inflight.get(cell)) is None:
+            task = self._inflight[cell] = self._hass.async_create_task(self._async_fetch(cell))
+            task.add_done_callback(lambda t: self._async_fetch_done(cell, t))
+        return await asyncio.shield(task)
+
+    async def _async_fetch(self, cell: str) -> dict[str, Any]:
+        self._hub.quota(self._key).record()
+        json_data = await self._hub.client(self._key).async_get(ENDPOINT_GRID_NOW, self.stats, location=cell)
+        self._cells[cell] = (monotonic(), json_data)
+        self._cells.move_to_end(cell)
+        while len(self._cells) > GRID_CACHE_SIZE:
+            self._cells.popitem(last=False)
+        return json_data
+
+    @callback
+    def _async_fetch_done(self, cell: str, task: asyncio.Task) -> None:
+        self._inflight.pop(cell, None)
+        if not task.cancelled():
+            task.exception()
+
+
+class GridTracker:
+    """跟随一个device_tracker或person实体的位置，网格变化时才请求."""
+
+    def __init__(self, hass: HomeAssistant, cache: GridCache, entity_id: str):
+        self._hass = hass
+        self._cache = cache
+        self.entity_id = entity_id
+        self.cell: str | None = None
+        self.values: dict[str, Any] = {}
+        self.updatetime: str | None = None
+        self.observed_at: float | None = None
+        self._task: asyncio.Task | None = None
+        self._listeners: list[CALLBACK_TYPE] = []
+
+    @callback
+    def async_start(self) -> Callable[[], None]:
+        """开始跟随实体的位置，返回停止的函数."""
+        unsubs = [
+            async_track_state_change_event(self._hass, [self.entity_id], self._async_state_changed),
+            async_track_time_interval(self._hass, self._async_refresh_interval, GRID_TTL),
+        ]
+        self._async_move(self._hass.states.get(self.entity_id))
+
+        @callback
+        def stop() -> None:
+            for unsub in unsubs:
+                unsub()
+            if self._task is not None:
+                self._task.cancel()
+
+        return stop
+
+    @callback
+    def _async_state_changed(self, event: Event) -> None:
+        self._async_move(event.data.get("new_state"))
+
+    @callback
+    def _async_move(self, state) -> None:
+        if state is None:
+            return
+        latitude, longitude = state.attributes.get(ATTR_LATITUDE), state.attributes.get(ATTR_LONGITUDE)
+        if latitude is None or longitude is None:
+            return
+        if (cell := grid_cell(latitude, longitude)) == self.cell:
+            # 仍在同一网格内，等到定时刷新
+            return
+        self.cell = cell
+        self._async_request()
+
+    @callback
+    def _async_refresh_interval(self, now) -> None:
+        if self.cell is not None:
+            self._async_request()
+
+    @callback
+    def _async_request(self) -> None:
+        if self._task is not None and not self._task.done():
+            # 在途的请求结束后会检查网格是否已经变化
+            return
+        self._task = self._hass.async_create_background_task(
+            self._async_refresh(), f"heweather grid {self.entity_id}"
+        )
+
+    async def _async_refresh(self) -> None:
+        while True:
+            cell = self.cell
+            try:
+                json_data = await self._cache.async_get(cell)
+            except (PermissionError, ConnectionError) as e:
+                _LOGGER.warning(f"Grid weather for {self.entity_id} failed: {type(e).__name__}")
+                return
+            if cell == self.cell:
+                break
+        now = json_data["now"]
+        for option in GRID_OPTIONS:
+            field = FIELDS[option]
+            self.values[option] = field.convert(now.get(field.json_key))
+        self.updatetime = now.get("obsTime")
+        self.observed_at = _observation_time(ENDPOINT_GRID_NOW, json_data)
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    @callback
+    def async_add_listener(self, update_callback: CALLBACK_TYPE) -> Callable[[], None]:
+        self._listeners.append(update_callback)
+        return lambda: self._listeners.remove(update_callback)
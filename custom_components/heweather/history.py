@@ -0,0 +1,106 @@
+"""数值数据项的内存历史，供趋势传感器使用，不读数据库也不增加请求."""
+from __future__ import annotations
+
+from array import array
+from collections import deque
+from datetime import timedelta
+
+# 每个数据项保存的观测数，以及统计的时间窗口
+HISTORY_POINTS = 36
+HISTORY_WINDOW = timedelta(hours=3)
+
+
+class FieldHistory:
+    """固定容量的环形缓冲，保存窗口内最近的观测.
+
+    平均值和最小二乘斜率用累加和维护，最小/最大值用单调队列维护，
+    每次加入观测均摊O(1)，读取统计量O(1).
+    """
+
+    __slots__ = (
+        "_capacity", "_window", "_times", "_values", "_start", "_end", "_origin",
+        "_sum_t", "_sum_v", "_sum_tt", "_sum_tv", "_min", "_max"
+    )
+
+    def __init__(self, capacity: int = HISTORY_POINTS, window: timedelta = HISTORY_WINDOW):
+        self._capacity = capacity
+        self._window = window.total_seconds()
+        self._times = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        # 最旧和下一个观测的序号，单调递增，对容量取模得到在数组中的位置
+        self._start = 0
+        self._end = 0
+        # 时间以第一个观测为原点，避免平方和丢失精度
+        self._origin: float | None = None
+        self._sum_t = self._sum_v = self._sum_tt = self._sum_tv = 0.0
+        # 窗口内的最小/最大值候选，保存序号
+        self._min: deque[int] = deque()
+        self._max: deque[int] = deque()
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def append(self, timestamp: float, value: float | None) -> None:
+        """加入一个观测；缺失的值和不比最新观测更新的观测被忽略."""
+        if value is None:
+            return
+        if self._origin is None:
+            self._origin = timestamp
+        t = timestamp - self._origin
+        if len(self) and t <= self._times[(self._end - 1) % self._capacity]:
+            return
+        while len(self) and (len(self) >= self._capacity or self._times[self._start % self._capacity] < t - self._window):
+            self._evict()
+        pos = self._end % self._capacity
+        self._times[pos] = t
+        self._values[pos] = value
+        self._sum_t += t
+        self._sum_v += value
+        self._sum_tt += t * t
+        self._sum_tv += t * value
+        while self._min and self._values[self._min[-1] % self._capacity] >= value:
+            self._min.pop()
+        self._min.append(self._end)
+        while self._max and self._values[self._max[-1] % self._capacity] <= value:
+            self._max.pop()
+        self._max.append(self._end)
+        self._end += 1
+
+    def _evict(self) -> None:
+        pos = self._start % self._capacity
+        t, value = self._times[pos], self._values[pos]
+        self._sum_t -= t
+        self._sum_v -= value
+        self._sum_tt -= t * t
+        self._sum_tv -= t * value
+        if self._min[0] == self._start:
+            self._min.popleft()
+        if self._max[0] == self._start:
+            self._max.popleft()
+        self._start += 1
+        if not len(self):
+            # 清空时重置累加和，消除浮点误差的累积
+            self._sum_t = self._sum_v = self._sum_tt = self._sum_tv = 0.0
+
+    @property
+    def minimum(self) -> float | None:
+        return self._values[self._min[0] % self._capacity] if self._min else None
+
+    @property
+    def maximum(self) -> float | None:
+        return self._values[self._max[0] % self._capacity] if self._max else None
+
+    @property
+    def mean(self) -> float | None:
+        return self._sum_v / len(self) if len(self) else None
+
+    @property
+    def rate(self) -> float | None:
+        """窗口内观测的最小二乘斜率，单位为每小时；少于两个观测时为None."""
+        n = len(self)
+        if n < 2:
+            return None
+        denominator = n * self._sum_tt - self._sum_t * self._sum_t
+        if denominator <= 0:
+            return None
+        return (n * self._sum_tv - self._sum_t * self._sum_v) / denominator * 3600
@@ -0,0 +1,284 @@
+"""和风天气城市列表的本地索引.
+
+城市列表缓存在.storage下的SQLite文件中，配置流程直接查询本地文件，
+按省份懒加载，不再每次下载和解析整个CSV；后台用条件请求定期刷新.
+"""
+from __future__ import annotations
+
+import asyncio
+import csv
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.storage import STORAGE_DIR
+
+from . import DOMAIN
+from .search import LocationSearch
+from .spatial import LocationTree
+
+_LOGGER = logging.getLogger(__name__)
+
+LOCATION_LIST_URL = "https://raw.githubusercontent.com/qwd/LocationList/master/China-City-List-latest.csv"
+LOCATION_DB_FILE = "heweather_locations.db"
+DATA_LOCATION_INDEX = "location_index"
+DATA_LOCATION_LOCK = "location_index_lock"
+
+REFRESH_INTERVAL = timedelta(days=7)
+
+Location = namedtuple(
+    "Location",
+    ["id", "name_en", "name_zh", "adm1_en", "adm1_zh", "adm2_en", "adm2_zh", "lat", "lon"],
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS location (
+    id TEXT PRIMARY KEY,
+    name_en TEXT NOT NULL,
+    name_zh TEXT NOT NULL,
+    adm1_en TEXT NOT NULL,
+    adm1_zh TEXT NOT NULL,
+    adm2_en TEXT NOT NULL,
+    adm2_zh TEXT NOT NULL,
+    lat REAL,
+    lon REAL
+);
+CREATE INDEX IF NOT EXISTS location_adm ON location (adm1_en, adm2_en);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _float(value: str) -> float | None:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_location_csv(text: str) -> list[Location]:
+    """解析和风天气的城市列表CSV."""
+    rows = []
+    for row in csv.reader(text.splitlines()):
+        if len(row) < 13 or not row[6] or row[6] == "Adm1_Name_EN":
+            continue
+        rows.append(Location(
+            row[0], row[1], row[2], row[6], row[7], row[8], row[9],
+            _float(row[11]), _float(row[12]),
+        ))
+    return rows
+
+
+class LocationIndex:
+    """SQLite上的城市索引.
+
+    除注明外所有方法都会访问磁盘，需要在executor中调用.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._provinces: dict[str, str] | None = None
+        self._cities: dict[str, dict[str, str]] = {}
+        self._search: LocationSearch | None = None
+        self._tree: LocationTree | None = None
+
+    def open(self) -> None:
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self._path, check_same_thread=False)
+                self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _query(self, sql: str, *args) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def is_empty(self) -> bool:
+        return not self._query("SELECT 1 FROM location LIMIT 1")
+
+    def get_meta(self, name: str) -> str | None:
+        rows = self._query("SELECT value FROM meta WHERE name = ?", name)
+        return rows[0][0] if rows else None
+
+    def set_meta(self, **values: str | None) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                [(k, v) for k, v in values.items() if v is not None],
+            )
+
+    def replace(self, locations: list[Location], **meta: str | None) -> None:
+        """整体替换城市列表."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM location")
+            # 与旧版本一致，同名地区以第一条为准
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO location VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                locations,
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                [(k, v) for k, v in meta.items() if v is not None],
+            )
+            self._provinces = None
+            self._cities = {}
+            self._search = None
+            self._tree = None
+
+    def provinces(self) -> dict[str, str]:
+        """省份英文名 -> 中文名."""
+        if self._provinces is None:
+            self._provinces = dict(self._query(
+                "SELECT adm1_en, MIN(adm1_zh) FROM location GROUP BY adm1_en ORDER BY MIN(rowid)"
+            ))
+        return self._provinces
+
+    def cities(self, province: str) -> dict[str, str]:
+        """某省份下的城市，英文名 -> 中文名，按省份缓存."""
+        if (cities := self._cities.get(province)) is None:
+            cities = self._cities[province] = dict(self._query(
+                "SELECT adm2_en, MIN(adm2_zh) FROM location WHERE adm1_en = ? "
+                "GROUP BY adm2_en ORDER BY MIN(rowid)",
+                province,
+            ))
+        return cities
+
+    def districts(self, province: str, city: str) -> dict[str, str]:
+        """某城市下的区县，英文名 -> 中文名."""
+        return dict(self._query(
+            "SELECT name_en, MIN(name_zh) FROM location WHERE adm1_en = ? AND adm2_en = ? "
+            "GROUP BY name_en ORDER BY MIN(rowid)",
+            province, city,
+        ))
+
+    def get(self, province: str, city: str, district: str) -> Location | None:
+        rows = self._query(
+            "SELECT * FROM location WHERE adm1_en = ? AND adm2_en = ? AND name_en = ? "
+            "ORDER BY rowid LIMIT 1",
+            province, city, district,
+        )
+        return Location(*rows[0]) if rows else None
+
+    def get_by_id(self, location_id: str) -> Location | None:
+        rows = self._query("SELECT * FROM location WHERE id = ?", location_id)
+        return Location(*rows[0]) if rows else None
+
+    def all(self) -> list[Location]:
+        return [Location(*row) for row in self._query("SELECT * FROM location ORDER BY rowid")]
+
+    def search(self, query: str, limit: int = 10) -> list[Location]:
+        """按中文名、英文名或拼音首字母搜索，首次调用时构建搜索索引."""
+        if self._search is None:
+            self._search = LocationSearch(self.all())
+        return self._search.search(query, limit)
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list[tuple[Location, float]]:
+        """离经纬度最近的k个城市及距离（公里），首次调用时构建KD树."""
+        if self._tree is None:
+            self._tree = LocationTree(self.all())
+        return self._tree.nearest(lat, lon, k)
+
+
+async def async_get_location_index(hass: HomeAssistant) -> LocationIndex:
+    """获取城市索引；本地没有缓存时下载一次，缓存过期时在后台刷新.
+
+    首次下载失败时抛出ConnectionError，不缓存空的索引，下次调用时重试.
+    """
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if (index := domain_data.get(DATA_LOCATION_INDEX)) is not None:
+        return index
+    # 同时进入的调用等待同一次加载，不会拿到还没建好的索引
+    async with domain_data.setdefault(DATA_LOCATION_LOCK, asyncio.Lock()):
+        if (index := domain_data.get(DATA_LOCATION_INDEX)) is not None:
+            return index
+        index = LocationIndex(hass.config.path(STORAGE_DIR, LOCATION_DB_FILE))
+        await hass.async_add_executor_job(index.open)
+        if await hass.async_add_executor_job(index.is_empty):
+            if (
+                not await async_refresh_location_index(hass, index)
+                or await hass.async_add_executor_job(index.is_empty)
+            ):
+                await hass.async_add_executor_job(index.close)
+                raise ConnectionError("location list unavailable")
+        else:
+            updated = await hass.async_add_executor_job(index.get_meta, "updated")
+            if time.time() - float(updated or 0) > REFRESH_INTERVAL.total_seconds():
+                hass.async_create_background_task(
+                    async_refresh_location_index(hass, index), "heweather location list refresh"
+                )
+        domain_data[DATA_LOCATION_INDEX] = index
+    return index
+
+
+async def async_nearest_location(
+    hass: HomeAssistant, lat: float, lon: float, k: int = 1
+) -> list[tuple[Location, float]]:
+    """离经纬度最近的k个城市，可用于按Home Assistant或zone的坐标批量配置."""
+    index = await async_get_location_index(hass)
+    return await hass.async_add_executor_job(index.nearest, lat, lon, k)
+
+
+async def async_location_point(hass: HomeAssistant, location_id: str) -> tuple[float, float] | None:
+    """城市的(纬度, 经度)；城市列表中没有该城市或暂时无法下载城市列表时返回None."""
+    try:
+        index = await async_get_location_index(hass)
+    except ConnectionError:
+        _LOGGER.warning(f"Location list unavailable, no coordinates for location {location_id}")
+        return None
+    loc = await hass.async_add_executor_job(index.get_by_id, location_id)
+    if loc is None or loc.lat is None or loc.lon is None:
+        _LOGGER.warning(f"No coordinates for location {location_id}")
+        return None
+    return loc.lat, loc.lon
+
+
+async def async_location_coordinates(hass: HomeAssistant, location_id: str) -> str | None:
+    """城市的坐标，格式为接口使用的"经度,纬度"；城市列表中没有该城市时返回None."""
+    if (point := await async_location_point(hass, location_id)) is None:
+        return None
+    return f"{point[1]:.2f},{point[0]:.2f}"
+
+
+async def async_refresh_location_index(hass: HomeAssistant, index: LocationIndex) -> bool:
+    """用条件请求刷新城市列表，列表未变化时只更新检查时间；下载失败时返回False."""
+    etag, last_modified = await hass.async_add_executor_job(
+        lambda: (index.get_meta("etag"), index.get_meta("last_modified"))
+    )
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    session = async_get_clientsession(hass)
+    try:
+        async with session.get(LOCATION_LIST_URL, headers=headers) as response:
+            if response.status == 304:
+                _LOGGER.debug("Location list not modified")
+                await hass.async_add_executor_job(lambda: index.set_meta(updated=str(time.time())))
+                return True
+            response.raise_for_status()
+            text = await response.text(encoding="utf-8-sig")
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except Exception as e:  # 刷新失败时继续使用旧的缓存
+        _LOGGER.warning("Error while downloading location list: %r", e)
+        return False
+    locations = await hass.async_add_executor_job(parse_location_csv, text)
+    await hass.async_add_executor_job(
+        lambda: index.replace(
+            locations, etag=etag, last_modified=last_modified, updated=str(time.time())
+        )
+    )
+    _LOGGER.info(f"Location list updated, {len(locations)} locations")
+    return True
@@ -0,0 +1,481 @@
+"""和风天气的天气数据."""
+import logging
+import time
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+
+from homeassistant.core import callback
+import homeassistant.util.dt as dt_util
+from homeassistant.const import (
+    CONCENTRATION_MICROGRAMS_PER_CUBIC_METER,
+    CONCENTRATION_MILLIGRAMS_PER_CUBIC_METER,
+    PERCENTAGE,
+    UnitOfLength,
+    UnitOfPressure,
+    UnitOfSpeed,
+    UnitOfTemperature,
+    UnitOfTime,
+    UnitOfVolumetricFlux
+)
+
+from .api import (
+    ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW, ENDPOINT_WARNING_NOW, NOW_ENDPOINTS,
+    ENDPOINT_FORECAST_HOURLY, ENDPOINT_FORECAST_DAILY, ENDPOINT_MINUTELY, ENDPOINT_GRID_NOW
+)
+from .coordinator import async_get_hub
+from .history import FieldHistory
+from .warning import EVENT_WARNING, WarningTracker
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _number(value):
+    """接口中的数值都是字符串，整数转为int，其余转为float，缺失时为None."""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _text(value):
+    return value if value != "" else None
+
+
+class Field(NamedTuple):
+    """一个数据项：来源接口、接口返回中的字段、类型转换、单位."""
+    endpoint: str
+    json_key: Optional[str]
+    convert: Callable
+    unit: Optional[str] = None
+
+
+# 较早的Home Assistant版本没有对应的常量
+UNIT_GRAMS_PER_CUBIC_METER = "g/m³"
+
+# 本地计算的数据项所用的"接口"，计算完成后按它通知实体，见derived
+DERIVED = "derived"
+
+# 所有数据项，解析、存储和实体取值都由这张表驱动；json_key为None的由WeatherData自行计算.
+# 可选的传感器见CONFIG_OPTIONS，其余数据项只供天气实体使用
+FIELDS = {
+    "temprature": Field(ENDPOINT_WEATHER_NOW, "temp", _number, UnitOfTemperature.CELSIUS),
+    "humidity": Field(ENDPOINT_WEATHER_NOW, "humidity", _number, PERCENTAGE),
+    "feelsLike": Field(ENDPOINT_WEATHER_NOW, "feelsLike", _number, UnitOfTemperature.CELSIUS),
+    "text": Field(ENDPOINT_WEATHER_NOW, "text", _text),
+    "precip": Field(ENDPOINT_WEATHER_NOW, "precip", _number, UnitOfVolumetricFlux.MILLIMETERS_PER_HOUR),
+    "windDir": Field(ENDPOINT_WEATHER_NOW, "windDir", _text),
+    "windScale": Field(ENDPOINT_WEATHER_NOW, "windScale", _text),
+    "windSpeed": Field(ENDPOINT_WEATHER_NOW, "windSpeed", _number, UnitOfSpeed.KILOMETERS_PER_HOUR),
+    "dew": Field(ENDPOINT_WEATHER_NOW, "dew", _number, UnitOfTemperature.CELSIUS),
+    "pressure": Field(ENDPOINT_WEATHER_NOW, "pressure", _number, UnitOfPressure.HPA),
+    "vis": Field(ENDPOINT_WEATHER_NOW, "vis", _number, UnitOfLength.KILOMETERS),
+    "cloud": Field(ENDPOINT_WEATHER_NOW, "cloud", _number, PERCENTAGE),
+    "icon": Field(ENDPOINT_WEATHER_NOW, "icon", _text),
+    "wind360": Field(ENDPOINT_WEATHER_NOW, "wind360", _number),
+
+    "primary": Field(ENDPOINT_AIR_NOW, "primary", _text),
+    "category": Field(ENDPOINT_AIR_NOW, "category", _text),
+    "level": Field(ENDPOINT_AIR_NOW, "level", _number),
+    "pm25": Field(ENDPOINT_AIR_NOW, "pm2p5", _number, CONCENTRATION_MICROGRAMS_PER_CUBIC_METER),
+    "pm10": Field(ENDPOINT_AIR_NOW, "pm10", _number, CONCENTRATION_MICROGRAMS_PER_CUBIC_METER),
+    "no2": Field(ENDPOINT_AIR_NOW, "no2", _number, CONCENTRATION_MICROGRAMS_PER_CUBIC_METER),
+    "so2": Field(ENDPOINT_AIR_NOW, "so2", _number, CONCENTRATION_MICROGRAMS_PER_CUBIC_METER),
+    "co": Field(ENDPOINT_AIR_NOW, "co", _number, CONCENTRATION_MILLIGRAMS_PER_CUBIC_METER),
+    "o3": Field(ENDPOINT_AIR_NOW, "o3", _number, CONCENTRATION_MICROGRAMS_PER_CUBIC_METER),
+    "qlty": Field(ENDPOINT_AIR_NOW, "aqi", _number),
+
+    "disaster_warn": Field(ENDPOINT_WARNING_NOW, None, str),
+    "rain_start": Field(ENDPOINT_MINUTELY, None, _number, UnitOfTime.MINUTES),
+
+    "heat_index": Field(DERIVED, None, _number, UnitOfTemperature.CELSIUS),
+    "wind_chill": Field(DERIVED, None, _number, UnitOfTemperature.CELSIUS),
+    "absolute_humidity": Field(DERIVED, None, _number, UNIT_GRAMS_PER_CUBIC_METER),
+    "cloud_base": Field(DERIVED, None, _number, UnitOfLength.METERS),
+    "aqi_pm25": Field(DERIVED, None, _number),
+    "aqi_pm10": Field(DERIVED, None, _number),
+    "aqi_no2": Field(DERIVED, None, _number),
+    "aqi_so2": Field(DERIVED, None, _number),
+    "aqi_co": Field(DERIVED, None, _number),
+    "aqi_o3": Field(DERIVED, None, _number),
+    "sunrise": Field(DERIVED, None, _text),
+    "sunset": Field(DERIVED, None, _text),
+    "moon_phase": Field(DERIVED, None, _text),
+}
+
+# 数据项在WeatherData.values中的位置
+FIELD_INDEX = {option: i for i, option in enumerate(FIELDS)}
+
+# 每个接口需要解析的字段：endpoint -> [(位置, 字段, 类型转换)]
+_ENDPOINT_FIELDS = {}
+for _option, _field in FIELDS.items():
+    if _field.json_key is not None:
+        _ENDPOINT_FIELDS.setdefault(_field.endpoint, []).append(
+            (FIELD_INDEX[_option], _field.json_key, _field.convert)
+        )
+
+_DISASTER_WARN = FIELD_INDEX["disaster_warn"]
+_RAIN_START = FIELD_INDEX["rain_start"]
+
+# 分钟级降水：两小时内每5分钟一个点
+MINUTELY_POINTS = 24
+# 逐小时预报中接下来几个小时的降水概率达到该值时，认为可能有降水
+PRECIPITATION_LIKELY_HOURS = 2
+PRECIPITATION_LIKELY_POP = 50
+# 预报只为有人在看的位置请求：天气实体有预报订阅，或在该时间（秒）内被读取过（如weather.get_forecasts）
+FORECAST_DEMAND_WINDOW = 86400
+
+
+# 接口数据的观测/发布时间，用于估计接口实际的更新间隔；未列出的接口取顶层的updateTime
+OBSERVATION_KEYS = {
+    ENDPOINT_WEATHER_NOW: ("now", "obsTime"),
+    ENDPOINT_AIR_NOW: ("now", "pubTime"),
+    ENDPOINT_GRID_NOW: ("now", "obsTime"),
+}
+
+
+def _observation_time(endpoint, json_data):
+    if endpoint in OBSERVATION_KEYS:
+        section, key = OBSERVATION_KEYS[endpoint]
+        value = json_data.get(section, {}).get(key)
+    else:
+        value = json_data.get("updateTime")
+    if value and (parsed := dt_util.parse_datetime(value)) is not None:
+        return parsed.timestamp()
+    return None
+
+
+class ForecastTier(NamedTuple):
+    """一级预报：接口返回中的列表字段，以及每列的(预报字段, 接口字段, 类型转换)."""
+    list_key: str
+    columns: tuple
+
+
+# 预报按行存为元组，取用时再按columns组装成字典
+FORECAST_TIERS = {
+    ENDPOINT_FORECAST_HOURLY: ForecastTier("hourly", (
+        ("datetime", "fxTime", _text),
+        ("icon", "icon", _text),
+        ("native_temperature", "temp", _number),
+        ("humidity", "humidity", _number),
+        ("precipitation_probability", "pop", _number),
+        ("native_precipitation", "precip", _number),
+        ("native_pressure", "pressure", _number),
+        ("native_wind_speed", "windSpeed", _number),
+        ("wind_bearing", "wind360", _number),
+        ("cloud_coverage", "cloud", _number),
+        ("native_dew_point", "dew", _number),
+    )),
+    ENDPOINT_FORECAST_DAILY: ForecastTier("daily", (
+        ("datetime", "fxDate", _text),
+        ("icon", "iconDay", _text),
+        ("native_temperature", "tempMax", _number),
+        ("native_templow", "tempMin", _number),
+        ("humidity", "humidity", _number),
+        ("native_precipitation", "precip", _number),
+        ("native_pressure", "pressure", _number),
+        ("native_wind_speed", "windSpeedDay", _number),
+        ("wind_bearing", "wind360Day", _number),
+        ("cloud_coverage", "cloud", _number),
+        ("uv_index", "uvIndex", _number),
+    )),
+}
+
+
+class WeatherData(object):
+    """天气相关的数据，存储在这个类中.
+
+    各数据项按FIELD_INDEX的顺序存放在values列表中，大量位置时省去每个实例的属性字典.
+    """
+
+    __slots__ = (
+        "_hass", "_disastermsg", "_disasterlevel", "_hub", "_listeners", "suppressed_writes",
+        "stale_endpoints", "fetched_at", "_warnings", "_restoring", "_unsub_hub", "_params",
+        "values", "_updatetime", "forecasts", "observed_at", "forecast_subscribers", "forecast_read_at",
+        "coordinates", "_minutely", "minutely_summary", "history", "_endpoint_history", "group"
+    )
+
+    def __init__(self, hass, location, key, disastermsg, disasterlevel, coordinates=None, history=(), group=None):
+        """初始化函数.
+
+        coordinates为"经度,纬度"时启用分钟级降水；history中的数值型数据项在内存中保存最近的观测；
+        属于fleet配置项时，group合并各位置的状态写入.
+        """
+        self._hass = hass
+        self._disastermsg = disastermsg
+        self._disasterlevel = disasterlevel
+
+        self._hub = async_get_hub(hass)
+        self._listeners = {}
+        self.suppressed_writes = 0
+        # 从快照恢复、尚未重新请求成功的接口
+        self.stale_endpoints = set()
+        # 各接口最近一次成功的时间戳
+        self.fetched_at = {}
+        self._warnings = WarningTracker(int(disasterlevel))
+        self._restoring = False
+        self._unsub_hub = [self._hub.async_subscribe(key, location, self._handle_result)]
+        self.coordinates = coordinates
+        self.group = group
+        if coordinates is not None:
+            self._unsub_hub.append(self._hub.async_subscribe(key, coordinates, self._handle_result))
+        # 分钟级降水的序列：固定长度的环形缓冲，元素为(时间戳, 降水量, 降水类型)
+        self._minutely = deque(maxlen=MINUTELY_POINTS)
+        self.minutely_summary = None
+        # 数据项 -> 最近观测的环形缓冲，按接口分组以便解析时直接追加
+        self.history = {
+            option: FieldHistory()
+            for option in history
+            if option in FIELDS and FIELDS[option].json_key is not None and FIELDS[option].convert is _number
+        }
+        self._endpoint_history = {}
+        for option, field_history in self.history.items():
+            self._endpoint_history.setdefault(FIELDS[option].endpoint, []).append(
+                (FIELD_INDEX[option], field_history)
+            )
+        self._params = {
+            "location": location, 
+            "key": key
+        }
+        self.values = [None] * len(FIELDS)
+        self._updatetime = None
+        # 各级预报：endpoint -> 按FORECAST_TIERS列顺序的行元组
+        self.forecasts = {}
+        # 各级预报的订阅数和最近一次被读取的时间戳
+        self.forecast_subscribers = {}
+        self.forecast_read_at = {}
+        # 各接口最近一次数据的观测/发布时间戳
+        self.observed_at = {}
+
+    def get(self, option):
+        """按数据项名称取值."""
+        return self.values[FIELD_INDEX[option]]
+
+    def forecast(self, endpoint):
+        """某一级预报，组装为字典的列表；还没有数据时返回None."""
+        if (rows := self.forecasts.get(endpoint)) is None:
+            return None
+        keys = [column[0] for column in FORECAST_TIERS[endpoint].columns]
+        return [dict(zip(keys, row)) for row in rows]
+
+    @callback
+    def async_forecast_subscribed(self, endpoint, delta):
+        """天气实体的预报订阅开始（delta=1）或结束（delta=-1）."""
+        self.forecast_subscribers[endpoint] = self.forecast_subscribers.get(endpoint, 0) + delta
+
+    @callback
+    def async_forecast_read(self, endpoint):
+        """记录预报被读取，之后一段时间内继续请求."""
+        self.forecast_read_at[endpoint] = time.time()
+
+    def forecast_wanted(self, endpoint):
+        """是否需要请求某一级预报."""
+        if self.forecast_subscribers.get(endpoint, 0) > 0:
+            return True
+        return time.time() - self.forecast_read_at.get(endpoint, 0) < FORECAST_DEMAND_WINDOW
+
+    @property
+    def minutely_forecast(self):
+        """分钟级降水的序列."""
+        return [
+            {"time": dt_util.utc_from_timestamp(timestamp).isoformat(), "precip": precip, "type": kind}
+            for timestamp, precip, kind in self._minutely
+        ]
+
+    def precipitation_likely(self):
+        """当前天气、分钟级降水或逐小时预报显示两小时内可能有降水时，才需要请求分钟级降水."""
+        if (icon := self.get("icon")) and icon[0] in "34":
+            return True
+        if self.minutely_summary and "无降水" not in self.minutely_summary:
+            return True
+        if any(precip for _, precip, _ in self._minutely):
+            return True
+        hourly = self.forecast(ENDPOINT_FORECAST_HOURLY) or []
+        return any(
+            (item["precipitation_probability"] or 0) >= PRECIPITATION_LIKELY_POP
+            for item in hourly[:PRECIPITATION_LIKELY_HOURS]
+        )
+
+    @property
+    def disaster_warnings(self):
+        """当前有效预警的明细."""
+        return self._warnings.active
+
+    @property
+    def updatetime(self):
+        """数据观测时间."""
+        return self._updatetime
+
+    @property
+    def location(self):
+        """城市ID."""
+        return self._params["location"]
+
+    @property
+    def key(self):
+        """API key."""
+        return self._params["key"]
+
+    async def async_update(self, now="", endpoints=NOW_ENDPOINTS):
+        """从远程更新信息，返回请求失败的接口；全部失败时抛出ConnectionError."""
+        _LOGGER.info(f"Update {', '.join(endpoints)} for location {self._params['location']} from HeFeng API...")
+
+        # 各接口并发请求，单个接口失败不影响其它接口；
+        # 请求经过协调器合并，成功的结果由_handle_result推送回来；
+        # 复用协调器中刚完成的结果时，也交给_handle_result
+        if ENDPOINT_WARNING_NOW in endpoints and not await self._has_warning():
+            # 不在批量预警列表中，不必单独请求预警详情
+            endpoints = tuple(e for e in endpoints if e != ENDPOINT_WARNING_NOW)
+            self._hub.async_publish(
+                self._params["key"], self._params["location"], ENDPOINT_WARNING_NOW, {"code": "200", "warning": []}
+            )
+            if not endpoints:
+                return set()
+        results = await self._hub.async_fetch_many(
+            self._params["key"], self._params["location"], endpoints,
+            {ENDPOINT_MINUTELY: self.coordinates} if self.coordinates else None,
+            self._handle_result
+        )
+        failed = {}
+        for endpoint, result in results.items():
+            if isinstance(result, PermissionError):
+                raise result
+            if isinstance(result, Exception):
+                failed[endpoint] = result
+        for endpoint, e in failed.items():
+            _LOGGER.error("Error while accessing %s for location %s: %r", endpoint, self._params["location"], e)
+        if len(failed) == len(results):
+            raise ConnectionError()
+        return set(failed)
+
+    async def _has_warning(self):
+        """按批量预警列表判断该位置是否可能有预警，列表请求失败时按有预警处理."""
+        try:
+            return self._params["location"] in await self._hub.async_warning_locations(self._params["key"])
+        except PermissionError:
+            raise
+        except ConnectionError as e:
+            _LOGGER.debug("Error while accessing warning list: %r", e)
+            return True
+
+    @callback
+    def async_restore(self, snapshot):
+        """从快照恢复上次成功的数据，标记为已过期，等待后台刷新.
+
+        恢复的预警作为已知预警，不触发事件.
+        """
+        self._restoring = True
+        for endpoint, item in snapshot.items():
+            self._handle_result(endpoint, item["data"])
+            self.stale_endpoints.add(endpoint)
+            self.fetched_at[endpoint] = item["time"]
+        self._restoring = False
+
+    @callback
+    def async_add_listener(self, update_callback, endpoint):
+        """某个接口的数据更新后调用update_callback，返回取消监听的函数."""
+        listeners = self._listeners.setdefault(endpoint, [])
+        listeners.append(update_callback)
+
+        @callback
+        def remove_listener():
+            listeners.remove(update_callback)
+
+        return remove_listener
+
+    @callback
+    def async_update_listeners(self, endpoint):
+        for update_callback in list(self._listeners.get(endpoint, ())):
+            update_callback()
+
+    @callback
+    def _handle_result(self, endpoint, json_data):
+        """协调器推送的接口数据，可能来自其它配置项发起的请求."""
+        observed = _observation_time(endpoint, json_data)
+        if endpoint == ENDPOINT_WARNING_NOW:
+            self._update_disaster_warn(json_data["warning"])
+        elif endpoint in _ENDPOINT_FIELDS:
+            self._update_fields(endpoint, json_data["now"], observed)
+        elif endpoint in FORECAST_TIERS:
+            self._update_forecast(endpoint, json_data[FORECAST_TIERS[endpoint].list_key])
+        elif endpoint == ENDPOINT_MINUTELY:
+            self._update_minutely(json_data)
+        else:
+            return
+        if observed is not None:
+            self.observed_at[endpoint] = observed
+        self.stale_endpoints.discard(endpoint)
+        self.fetched_at[endpoint] = time.time()
+        if self.group is not None and not self._restoring:
+            self.group.async_schedule(self, endpoint)
+        else:
+            self.async_update_listeners(endpoint)
+
+    @callback
+    def async_shutdown(self):
+        """取消对协调器的订阅."""
+        for unsub in self._unsub_hub:
+            unsub()
+
+    def _update_fields(self, endpoint, now, observed=None):
+        # 根据http返回的结果，按字段表更新数据
+        values = self.values
+        for index, json_key, convert in _ENDPOINT_FIELDS[endpoint]:
+            values[index] = convert(now.get(json_key))
+        # 同一观测重复返回时不会重复记录
+        timestamp = observed if observed is not None else time.time()
+        for index, field_history in self._endpoint_history.get(endpoint, ()):
+            field_history.append(timestamp, values[index])
+        if endpoint == ENDPOINT_WEATHER_NOW:
+            self._updatetime = now.get("obsTime")
+
+    def _update_forecast(self, endpoint, items):
+        columns = FORECAST_TIERS[endpoint].columns
+        self.forecasts[endpoint] = tuple(
+            tuple(convert(item.get(json_key)) for _, json_key, convert in columns)
+            for item in items
+        )
+
+    def _update_minutely(self, json_data):
+        self._minutely.clear()
+        for item in json_data.get("minutely", []):
+            if (fx_time := dt_util.parse_datetime(item.get("fxTime", ""))) is None:
+                continue
+            self._minutely.append((fx_time.timestamp(), _number(item.get("precip")), item.get("type")))
+        self.minutely_summary = json_data.get("summary")
+        self.values[_RAIN_START] = self._rain_start()
+
+    def _rain_start(self):
+        # 距离序列中第一个有降水的点的分钟数，正在下雨时为0，两小时内无降水时为None
+        now = time.time()
+        for timestamp, precip, _ in self._minutely:
+            if precip:
+                return max(0, round((timestamp - now) / 60))
+        return None
+
+    def _update_disaster_warn(self, disaster_warn):
+        # 只处理变化的预警，为每个变化触发heweather_warning事件
+        changes = self._warnings.update(disaster_warn)
+        if not self._restoring:
+            for kind, warning in changes:
+                self._hass.bus.async_fire(EVENT_WARNING, {
+                    "change": kind,
+                    "location": self._params["location"],
+                    **warning
+                })
+        if changes or self.values[_DISASTER_WARN] is None:
+            self.values[_DISASTER_WARN] = self._format_disaster_warn(self._warnings.active)
+
+    def _format_disaster_warn(self, active):
+        if len(active) == 0:
+            return f'近日无{self._disasterlevel}级及以上灾害'
+        #if(订阅标题)
+        elif self._disastermsg == 'title':
+            return "#".join(w["simple_title"] for w in active)[:255]
+        else:
+            return "#".join(f'{w["simple_title"]}-{w["text"]}' for w in active)[:255]
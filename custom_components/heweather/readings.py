@@ -0,0 +1,141 @@
+"""所有位置读数的列式快照，供heweather.get_snapshot服务和websocket命令一次取回.
+
+快照常驻内存，接口数据更新时只改写对应位置的对应列；两次更新之间的读取共用同一份结果.
+"""
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import Any
+
+import voluptuous as vol
+
+from homeassistant.components import websocket_api
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse, callback
+import homeassistant.util.dt as dt_util
+
+from . import DOMAIN
+from .model import FIELDS
+from .sensor import OPTIONS
+
+DATA_READINGS = "readings"
+
+SERVICE_GET_SNAPSHOT = "get_snapshot"
+WS_TYPE_SNAPSHOT = f"{DOMAIN}/snapshot"
+
+# 快照的列：OPTIONS中的所有类型
+SNAPSHOT_FIELDS = tuple(OPTIONS)
+# 有数据项的接口 -> 该接口的类型，接口更新时只改写这些列
+_ENDPOINT_FIELDS: dict[str, list[str]] = {}
+for _option in SNAPSHOT_FIELDS:
+    _ENDPOINT_FIELDS.setdefault(FIELDS[_option].endpoint, []).append(_option)
+SNAPSHOT_ENDPOINTS = tuple(_ENDPOINT_FIELDS)
+
+
+@callback
+def async_get_readings(hass: HomeAssistant) -> ReadingsTable:
+    """获取（必要时创建）hass.data[DOMAIN]中的快照."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if (table := domain_data.get(DATA_READINGS)) is None:
+        table = domain_data[DATA_READINGS] = ReadingsTable()
+    return table
+
+
+class ReadingsTable:
+    """每个位置一行，每个类型一列；观测时间和是否过期按接口分列."""
+
+    def __init__(self):
+        self._rows: dict[Any, int] = {}
+        self.locations: list[str] = []
+        self.names: list[str] = []
+        self.columns: dict[str, list] = {option: [] for option in SNAPSHOT_FIELDS}
+        self.observed_at: dict[str, list] = {endpoint: [] for endpoint in SNAPSHOT_ENDPOINTS}
+        self.stale: dict[str, list] = {endpoint: [] for endpoint in SNAPSHOT_ENDPOINTS}
+        self._updated = dt_util.utcnow()
+        self._cached: dict[str, Any] | None = None
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    @callback
+    def async_add(self, data, name: str | None) -> Callable[[], None]:
+        """加入一个位置（WeatherData）并跟随它的更新，返回移除的函数."""
+        self._rows[data] = len(self.locations)
+        self.locations.append(data.location)
+        self.names.append(name or data.location)
+        for column in (*self.columns.values(), *self.observed_at.values(), *self.stale.values()):
+            column.append(None)
+        for endpoint in SNAPSHOT_ENDPOINTS:
+            self._update_row(data, endpoint)
+        unsubs = [
+            data.async_add_listener(self._updater(data, endpoint), endpoint)
+            for endpoint in SNAPSHOT_ENDPOINTS
+        ]
+
+        @callback
+        def remove() -> None:
+            for unsub in unsubs:
+                unsub()
+            self._remove_row(data)
+
+        return remove
+
+    def _updater(self, data, endpoint: str) -> Callable[[], None]:
+        @callback
+        def update() -> None:
+            self._update_row(data, endpoint)
+
+        return update
+
+    def _update_row(self, data, endpoint: str) -> None:
+        row = self._rows[data]
+        for option in _ENDPOINT_FIELDS[endpoint]:
+            self.columns[option][row] = data.get(option)
+        self.observed_at[endpoint][row] = data.observed_at.get(endpoint)
+        self.stale[endpoint][row] = endpoint in data.stale_endpoints
+        self._updated = dt_util.utcnow()
+        self._cached = None
+
+    def _remove_row(self, data) -> None:
+        row = self._rows.pop(data)
+        for column in (
+            self.locations, self.names,
+            *self.columns.values(), *self.observed_at.values(), *self.stale.values()
+        ):
+            del column[row]
+        for other, index in self._rows.items():
+            if index > row:
+                self._rows[other] = index - 1
+        self._cached = None
+
+    def as_dict(self) -> dict[str, Any]:
+        """列式的快照；没有更新时复用上次的结果."""
+        if self._cached is None:
+            self._cached = {
+                "updated": self._updated.isoformat(),
+                "locations": list(self.locations),
+                "names": list(self.names),
+                "fields": {option: list(column) for option, column in self.columns.items()},
+                "observed_at": {endpoint: list(column) for endpoint, column in self.observed_at.items()},
+                "stale": {endpoint: list(column) for endpoint, column in self.stale.items()},
+            }
+        return self._cached
+
+
+@callback
+def async_register_api(hass: HomeAssistant) -> None:
+    """注册heweather.get_snapshot服务和websocket命令."""
+
+    async def async_get_snapshot(call: ServiceCall) -> ServiceResponse:
+        return async_get_readings(hass).as_dict()
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_GET_SNAPSHOT, async_get_snapshot,
+        schema=vol.Schema({}), supports_response=SupportsResponse.ONLY
+    )
+    websocket_api.async_register_command(hass, websocket_get_snapshot)
+
+
+@websocket_api.websocket_command({vol.Required("type"): WS_TYPE_SNAPSHOT})
+@callback
+def websocket_get_snapshot(hass: HomeAssistant, connection: websocket_api.ActiveConnection, msg: dict) -> None:
+    connection.send_result(msg["id"], async_get_readings(hass).as_dict())
@@ -0,0 +1,441 @@
+"""所有配置项共享的请求调度器，按每日调用预算安排各位置、各接口的请求."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import random
+import zlib
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+import homeassistant.util.dt as dt_util
+
+from . import TIME_BETWEEN_UPDATES, DEFAULT_DAILY_BUDGET
+from .api import (
+    ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW, ENDPOINT_WARNING_NOW,
+    ENDPOINT_FORECAST_HOURLY, ENDPOINT_FORECAST_DAILY, ENDPOINT_MINUTELY
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# 各接口分配预算的权重，预警和实况天气多分，空气质量少分
+ENDPOINT_PRIORITY = {
+    ENDPOINT_WEATHER_NOW: 3,
+    ENDPOINT_WARNING_NOW: 3,
+    ENDPOINT_AIR_NOW: 1,
+}
+
+# 预报的最短更新间隔，只为需要预报的位置请求（见WeatherData.forecast_wanted），先从预算中扣除，
+# 剩余的预算再按权重分给实况接口
+FORECAST_INTERVAL = {
+    ENDPOINT_FORECAST_HOURLY: timedelta(minutes=30),
+    ENDPOINT_FORECAST_DAILY: timedelta(hours=3),
+}
+# 预报最多占用的预算比例，超出时各级预报的间隔按比例放大，其余的预算保证留给实况和预警
+FORECAST_BUDGET_SHARE = 0.4
+
+SCHEDULED_ENDPOINTS = (*ENDPOINT_PRIORITY, *FORECAST_INTERVAL)
+
+# 分钟级降水只在可能有降水时请求，请求时每5分钟一次，不预留预算
+MINUTELY_INTERVAL = timedelta(minutes=5)
+
+# 从观测/发布时间学到的接口更新间隔的范围
+CADENCE_MIN = timedelta(minutes=5)
+CADENCE_MAX = timedelta(hours=3)
+# 预计的发布时间之后稍等再请求，各位置按相位分散在PUBLISH_SPREAD内
+PUBLISH_LAG = timedelta(minutes=2)
+PUBLISH_SPREAD = timedelta(minutes=5)
+# 过了预计的发布时间数据仍没有变化时，间隔按IDLE_BACKOFF倍增加，不超过IDLE_INTERVAL_MAX
+IDLE_BACKOFF = 1.5
+IDLE_INTERVAL_MAX = timedelta(hours=1)
+# 有生效的预警时，实况和预警接口的间隔缩短为WARNING_TIGHTEN倍，不低于WARNING_INTERVAL_MIN
+WARNING_TIGHTEN = 0.5
+WARNING_INTERVAL_MIN = timedelta(minutes=5)
+WARNING_TIGHTENED_ENDPOINTS = (ENDPOINT_WEATHER_NOW, ENDPOINT_WARNING_NOW)
+
+# 预警随事件发布，没有固定的发布周期可学，长时间不变也不应放慢，始终按预算的间隔请求
+CADENCE_ENDPOINTS = (ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW)
+
+SCHEDULER_TICK = timedelta(seconds=30)
+# 新增位置后稍等片刻再调度，合并启动时同时加入的位置
+SCHEDULE_DEBOUNCE = 1
+
+# 同时进行更新的位置数，fleet配置项的位置使用该配置项自己的并发限制
+MAX_CONCURRENT_UPDATES = 4
+
+# 更新失败后的退避：BACKOFF_BASE * 2^(n-1)，加入随机抖动，不超过BACKOFF_MAX
+BACKOFF_BASE = timedelta(seconds=60)
+BACKOFF_MAX = timedelta(hours=1)
+
+# 连续多个位置更新失败时熔断，冷却期内不再请求，之后先放行一个位置试探
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = timedelta(minutes=5)
+BREAKER_COOLDOWN_MAX = timedelta(hours=1)
+
+
+def _phase(location: str, endpoint: str) -> float:
+    """每个位置、接口固定的相位（0~1），使各位置的请求均匀分布在间隔内."""
+    return zlib.crc32(f"{location}/{endpoint}".encode()) / 2**32
+
+
+def _next_slot(timestamp: float, interval: float, phase: float) -> float:
+    """timestamp之后、按相位对齐的下一个请求时刻."""
+    offset = interval * phase
+    return offset + (math.floor((timestamp - offset) / interval) + 1) * interval
+
+
+def _due_order(endpoint: str) -> tuple:
+    """预算不够时接口的先后：预警、实况天气、空气质量，最后是分钟级降水和预报."""
+    return endpoint != ENDPOINT_WARNING_NOW, -ENDPOINT_PRIORITY.get(endpoint, 0)
+
+
+def _backoff(failures: int) -> float:
+    delay = min(BACKOFF_MAX.total_seconds(), BACKOFF_BASE.total_seconds() * 2 ** (failures - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class QuotaTracker:
+    """某个API key的每日调用预算，本地时间0点重置.
+
+    每次调用后通过on_record通知协调器保存，重启后继续累计当天已用的次数.
+    """
+
+    def __init__(self, budget: int = DEFAULT_DAILY_BUDGET, on_record: CALLBACK_TYPE | None = None):
+        self.budget = budget
+        self.used = 0
+        self._day = dt_util.now().date()
+        self._on_record = on_record
+        self._listeners: list[CALLBACK_TYPE] = []
+
+    def _roll_over(self, now: datetime) -> None:
+        if now.date() != self._day:
+            self._day = now.date()
+            self.used = 0
+
+    @callback
+    def record(self, calls: int = 1) -> None:
+        self._roll_over(dt_util.now())
+        self.used += calls
+        if self._on_record is not None:
+            self._on_record()
+
+    def restore(self, stored: dict) -> None:
+        """加上保存的当天已用次数，不是今天的记录直接忽略."""
+        self._roll_over(dt_util.now())
+        if stored.get("day") == self._day.isoformat():
+            self.used += stored.get("used", 0)
+
+    def as_dict(self) -> dict:
+        self._roll_over(dt_util.now())
+        return {"day": self._day.isoformat(), "used": self.used}
+
+    @property
+    def remaining(self) -> int:
+        self._roll_over(dt_util.now())
+        return max(0, self.budget - self.used)
+
+    def exhaustion_time(self) -> datetime | None:
+        """按今天已用的速度预计耗尽的时间，今天内不会耗尽时返回None."""
+        now = dt_util.now()
+        self._roll_over(now)
+        midnight = dt_util.start_of_local_day(now)
+        elapsed = (now - midnight).total_seconds()
+        if self.remaining == 0:
+            return now
+        if not self.used or elapsed <= 0:
+            return None
+        exhaustion = now + timedelta(seconds=self.remaining * elapsed / self.used)
+        return exhaustion if exhaustion < midnight + timedelta(days=1) else None
+
+    def interval(self, endpoint: str, locations: int, forecasts: dict[str, int] | None = None) -> float:
+        """预算均匀分配到一天中时，某接口对每个位置的请求间隔（秒）.
+
+        forecasts为各级预报需要请求的位置数.
+        """
+        day = timedelta(days=1).total_seconds()
+        forecasts = forecasts or {}
+        # 按最短间隔请求预报所需的次数，超过预报的份额时整体放慢
+        wanted = sum(
+            day / interval.total_seconds() * forecasts.get(e, 0) for e, interval in FORECAST_INTERVAL.items()
+        )
+        reserved = min(wanted, self.budget * FORECAST_BUDGET_SHARE)
+        if endpoint in FORECAST_INTERVAL:
+            if reserved <= 0:
+                return day
+            return FORECAST_INTERVAL[endpoint].total_seconds() * wanted / reserved
+        budget = self.budget - reserved
+        share = budget * ENDPOINT_PRIORITY[endpoint] / sum(ENDPOINT_PRIORITY.values())
+        calls = share / max(1, locations)
+        if calls <= 0:
+            return day
+        return max(TIME_BETWEEN_UPDATES.total_seconds(), day / calls)
+
+    @callback
+    def async_add_listener(self, update_callback: CALLBACK_TYPE) -> Callable[[], None]:
+        self._listeners.append(update_callback)
+        return lambda: self._listeners.remove(update_callback)
+
+    @callback
+    def async_update_listeners(self) -> None:
+        for update_callback in list(self._listeners):
+            update_callback()
+
+
+class CircuitBreaker:
+    """接口整体不可用时停止请求，避免故障期间的重试风暴."""
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self._cooldown = BREAKER_COOLDOWN.total_seconds()
+        self._probing = False
+
+    def allow(self, timestamp: float) -> bool:
+        """关闭时全部放行；冷却结束后只放行一个试探请求."""
+        if self.failures < BREAKER_THRESHOLD:
+            return True
+        if timestamp < self.open_until or self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        if self.failures >= BREAKER_THRESHOLD:
+            _LOGGER.info("HeFeng API recovered, circuit closed")
+        self.failures = 0
+        self._probing = False
+        self._cooldown = BREAKER_COOLDOWN.total_seconds()
+
+    def record_failure(self, timestamp: float) -> None:
+        self.failures += 1
+        if self.failures < BREAKER_THRESHOLD:
+            return
+        if self._probing:
+            # 试探失败，冷却时间加倍
+            self._cooldown = min(BREAKER_COOLDOWN_MAX.total_seconds(), self._cooldown * 2)
+        self._probing = False
+        self.open_until = timestamp + self._cooldown
+        _LOGGER.warning(f"HeFeng API unavailable, pause requests for {self._cooldown:.0f}s")
+
+
+class Cadence:
+    """根据接口返回的观测/发布时间，估计某个位置某个接口实际的更新间隔."""
+
+    def __init__(self, observed: float | None = None):
+        self.observed = observed
+        self.interval: float | None = None
+        # 连续没有拿到新数据的次数
+        self.unchanged = 0
+
+    def update(self, observed: float | None) -> None:
+        """记录一次请求后的观测时间."""
+        if observed is None:
+            return
+        if self.observed is not None and observed <= self.observed:
+            self.unchanged += 1
+            return
+        if self.observed is not None:
+            sample = min(CADENCE_MAX.total_seconds(), max(CADENCE_MIN.total_seconds(), observed - self.observed))
+            # 请求比发布慢时样本是间隔的整数倍，较小的样本直接采用，较大的样本缓慢跟随
+            if self.interval is None or sample < self.interval:
+                self.interval = sample
+            else:
+                self.interval = 0.8 * self.interval + 0.2 * sample
+        self.observed = observed
+        self.unchanged = 0
+
+    def next_poll(self, timestamp: float, interval: float, phase: float) -> float:
+        """下一次请求的时刻，不早于按预算分配的间隔interval."""
+        earliest = timestamp + interval
+        if self.interval is None or self.observed is None:
+            return earliest
+        expected = self.observed + self.interval + PUBLISH_LAG.total_seconds()
+        if expected <= timestamp:
+            # 过了预计的发布时间仍没有新数据，逐步放慢
+            idle = min(IDLE_INTERVAL_MAX.total_seconds(), interval * IDLE_BACKOFF ** self.unchanged)
+            return timestamp + max(interval, idle)
+        return max(earliest, expected + phase * PUBLISH_SPREAD.total_seconds())
+
+
+class _Job:
+    """一个位置（WeatherData）的调度状态."""
+
+    def __init__(self, data, budget: int, semaphore: asyncio.Semaphore):
+        self.data = data
+        self.budget = budget
+        self.semaphore = semaphore
+        self.failures = 0
+        self.running = False
+        # 还没有数据的接口立即请求，已从快照恢复的接口按相位错开；
+        # 快照中的预报还没到更新间隔时，不必在启动后马上重新请求
+        now = dt_util.utcnow().timestamp()
+        self.next_due = {
+            endpoint: _next_slot(
+                max(now, data.fetched_at[endpoint]),
+                FORECAST_INTERVAL.get(endpoint, TIME_BETWEEN_UPDATES).total_seconds(),
+                _phase(data.location, endpoint)
+            )
+            if endpoint in data.fetched_at else now
+            for endpoint in SCHEDULED_ENDPOINTS
+        }
+        if data.coordinates is not None:
+            self.next_due[ENDPOINT_MINUTELY] = now
+        self.cadence = {
+            endpoint: Cadence(data.observed_at.get(endpoint)) for endpoint in CADENCE_ENDPOINTS
+        }
+
+
+class UpdateScheduler:
+    """定时检查各位置各接口是否到期，到期的接口合并成一次更新.
+
+    各位置按固定相位错开请求，并限制同时更新的位置数；失败后指数退避，
+    连续失败时熔断.
+    """
+
+    def __init__(self, hass: HomeAssistant, hub):
+        self._hass = hass
+        self._hub = hub
+        self._jobs: list[_Job] = []
+        self._unsub_tick: CALLBACK_TYPE | None = None
+        self._unsub_debounce: CALLBACK_TYPE | None = None
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+        self.breaker = CircuitBreaker()
+
+    @callback
+    def async_add(self, data, budget: int = DEFAULT_DAILY_BUDGET) -> Callable[[], None]:
+        """加入调度，返回移出调度的函数."""
+        group = data.group
+        job = _Job(data, budget, group.semaphore if group is not None else self._semaphore)
+        self._jobs.append(job)
+        self._update_budget(data.key)
+        if self._unsub_tick is None:
+            self._unsub_tick = async_track_time_interval(self._hass, self._async_tick, SCHEDULER_TICK)
+        if self._unsub_debounce is None:
+            self._unsub_debounce = async_call_later(self._hass, SCHEDULE_DEBOUNCE, self._async_debounced_tick)
+
+        @callback
+        def remove_job() -> None:
+            self._jobs.remove(job)
+            self._update_budget(data.key)
+            if not self._jobs:
+                self._unsub_tick()
+                self._unsub_tick = None
+
+        return remove_job
+
+    def _jobs_for_key(self, key: str) -> list[_Job]:
+        return [job for job in self._jobs if job.data.key == key]
+
+    def _update_budget(self, key: str) -> None:
+        # 同一个key配置了不同预算时，取最小值
+        if jobs := self._jobs_for_key(key):
+            self._hub.quota(key).budget = min(job.budget for job in jobs)
+
+    def _interval(self, job: _Job, endpoint: str) -> float:
+        """按预算分配的请求间隔，有生效的预警时缩短实况和预警接口的间隔."""
+        if endpoint == ENDPOINT_MINUTELY:
+            return MINUTELY_INTERVAL.total_seconds()
+        key = job.data.key
+        jobs = self._jobs_for_key(key)
+        forecasts = {e: sum(j.data.forecast_wanted(e) for j in jobs) for e in FORECAST_INTERVAL}
+        interval = self._hub.quota(key).interval(endpoint, len(jobs), forecasts)
+        if endpoint in WARNING_TIGHTENED_ENDPOINTS and job.data.disaster_warnings:
+            interval = max(WARNING_INTERVAL_MIN.total_seconds(), interval * WARNING_TIGHTEN)
+        return interval
+
+    def _reschedule(self, job: _Job, due: list[str]) -> None:
+        """请求成功后，按学到的更新间隔安排下一次请求：在预计的发布之后请求，数据不变时放慢."""
+        timestamp = dt_util.utcnow().timestamp()
+        for endpoint in due:
+            if (cadence := job.cadence.get(endpoint)) is None:
+                continue
+            cadence.update(job.data.observed_at.get(endpoint))
+            job.next_due[endpoint] = cadence.next_poll(
+                timestamp, self._interval(job, endpoint), _phase(job.data.location, endpoint)
+            )
+
+    @callback
+    def _async_debounced_tick(self, now) -> None:
+        self._unsub_debounce = None
+        self._async_tick(now)
+
+    @callback
+    def _async_tick(self, now=None) -> None:
+        timestamp = dt_util.utcnow().timestamp()
+        batch = []
+        for job in self._jobs:
+            # 分钟级降水到期后仍要等到可能有降水时才请求，预报要等到有人需要时才请求，期间每轮重新判断
+            due = [
+                e for e, t in job.next_due.items()
+                if t <= timestamp
+                and (e != ENDPOINT_MINUTELY or job.data.precipitation_likely())
+                and (e not in FORECAST_INTERVAL or job.data.forecast_wanted(e))
+            ]
+            if not due or job.running:
+                continue
+            quota = self._hub.quota(job.data.key)
+            if quota.remaining < len(due):
+                # 预算不够时先请求预警和实况，用完后等待0点重置，实体保留已有的数据
+                due = sorted(due, key=_due_order)[:quota.remaining]
+                if not due:
+                    continue
+            if not self.breaker.allow(timestamp):
+                continue
+            # 请求成功后由_reschedule按学到的更新间隔重新安排
+            for endpoint in due:
+                job.next_due[endpoint] = _next_slot(
+                    timestamp, self._interval(job, endpoint), _phase(job.data.location, endpoint)
+                )
+            job.running = True
+            batch.append((job, due))
+        if batch:
+            self._hass.async_create_background_task(self._async_run(batch), "heweather scheduled update")
+
+    async def _async_run(self, batch: list[tuple[_Job, list[str]]]) -> None:
+        await asyncio.gather(*(self._async_run_job(job, due) for job, due in batch))
+        # 一轮请求结束后统一写入fleet各位置的状态，并通知预算的变化
+        for group in {job.data.group for job, _ in batch} - {None}:
+            group.async_flush()
+        for quota in {self._hub.quota(job.data.key) for job, _ in batch}:
+            quota.async_update_listeners()
+
+    def _back_off(self, job: _Job, endpoints) -> tuple[float, float]:
+        """失败的接口按连续失败次数推迟，返回(当前时间戳, 推迟的秒数)."""
+        timestamp = dt_util.utcnow().timestamp()
+        job.failures += 1
+        delay = _backoff(job.failures)
+        for endpoint in endpoints:
+            job.next_due[endpoint] = timestamp + delay
+        return timestamp, delay
+
+    async def _async_run_job(self, job: _Job, due: list[str]) -> None:
+        location = job.data.location
+        try:
+            async with job.semaphore:
+                failed = await job.data.async_update(endpoints=due)
+        except (PermissionError, ConnectionError) as e:
+            timestamp, delay = self._back_off(job, due)
+            if isinstance(e, PermissionError):
+                # 接口本身可用，key失效只影响使用该key的位置，不计入熔断
+                self.breaker.record_success()
+                _LOGGER.error(f"API key rejected for location {location}, retry in {delay:.0f}s")
+            else:
+                self.breaker.record_failure(timestamp)
+                _LOGGER.warning(f"Update failed for location {location}, keep last known data, retry in {delay:.0f}s")
+        else:
+            if failed:
+                # 部分接口失败：失败的接口退避重试，不能当作数据没有变化去学习更新间隔
+                timestamp, delay = self._back_off(job, failed)
+                self.breaker.record_failure(timestamp)
+                _LOGGER.warning(
+                    f"Update of {', '.join(sorted(failed))} failed for location {location}, retry in {delay:.0f}s"
+                )
+            else:
+                job.failures = 0
+                self.breaker.record_success()
+            self._reschedule(job, [e for e in due if e not in failed])
+        finally:
+            job.running = False
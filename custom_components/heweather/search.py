@@ -0,0 +1,134 @@
+"""城市列表的模糊搜索，支持中文名、英文名（即全拼）和拼音首字母."""
+from __future__ import annotations
+
+from bisect import bisect_left
+from heapq import nsmallest
+from collections.abc import Sequence
+
+_SYLLABLES = frozenset("""
+a ai an ang ao ba bai ban bang bao bei ben beng bi bian biao bie bin bing bo bu
+ca cai can cang cao ce cen ceng cha chai chan chang chao che chen cheng chi chong
+chou chu chua chuai chuan chuang chui chun chuo ci cong cou cu cuan cui cun cuo
+da dai dan dang dao de dei den deng di dia dian diao die ding diu dong dou du duan
+dui dun duo e ei en eng er fa fan fang fei fen feng fo fou fu ga gai gan gang gao
+ge gei gen geng gong gou gu gua guai guan guang gui gun guo ha hai han hang hao he
+hei hen heng hong hou hu hua huai huan huang hui hun huo ji jia jian jiang jiao jie
+jin jing jiong jiu ju juan jue jun ka kai kan kang kao ke kei ken keng kong kou ku
+kua kuai kuan kuang kui kun kuo la lai lan lang lao le lei leng li lia lian liang
+liao lie lin ling liu lo long lou lu luan lun luo lv lve ma mai man mang mao me mei
+men meng mi mian miao mie min ming miu mo mou mu na nai nan nang nao ne nei nen
+neng ni nian niang niao nie nin ning niu nong nou nu nuan nuo nv nve o ou pa pai
+pan pang pao pei pen peng pi pian piao pie pin ping po pou pu qi qia qian qiang qiao
+qie qin qing qiong qiu qu quan que qun ran rang rao re ren reng ri rong rou ru rua
+ruan rui run ruo sa sai san sang sao se sen seng sha shai shan shang shao she shei
+shen sheng shi shou shu shua shuai shuan shuang shui shun shuo si song sou su suan
+sui sun suo ta tai tan tang tao te teng ti tian tiao tie ting tong tou tu tuan tui
+tun tuo wa wai wan wang wei wen weng wo wu xi xia xian xiang xiao xie xin xing xiong
+xiu xu xuan xue xun ya yan yang yao ye yi yin ying yo yong you yu yuan yue yun za
+zai zan zang zao ze zei zen zeng zha zhai zhan zhang zhao zhe zhei zhen zheng zhi
+zhong zhou zhu zhua zhuai zhuan zhuang zhui zhun zhuo zi zong zou zu zuan zui zun zuo
+""".split())
+_MAX_SYLLABLE = max(map(len, _SYLLABLES))
+
+# 匹配类型，数值越小排名越靠前
+_EXACT, _PREFIX, _SUBSTRING = range(3)
+
+
+def _normalize(text: str) -> str:
+    return "".join(c for c in text.lower() if c.isalnum())
+
+
+def _is_cjk(text: str) -> bool:
+    return any("一" <= c <= "鿿" for c in text)
+
+
+def pinyin_initials(name_en: str) -> str:
+    """把拼音拼写的英文名切分成音节，返回首字母，如Chaoyang -> cy.
+
+    无法完整切分时（非拼音的英文名）返回空字符串.
+    """
+    initials = []
+    for word in name_en.lower().replace("'", " ").replace("-", " ").split():
+        if not (syllables := _split_syllables(word)):
+            return ""
+        initials.extend(s[0] for s in syllables)
+    return "".join(initials)
+
+
+def _split_syllables(word: str) -> list[str] | None:
+    # 最长匹配优先，失败时回溯，如xian优先切为xian而不是xi-an
+    if not word:
+        return []
+    for size in range(min(_MAX_SYLLABLE, len(word)), 0, -1):
+        if word[:size] in _SYLLABLES and (rest := _split_syllables(word[size:])) is not None:
+            return [word[:size], *rest]
+    return None
+
+
+class LocationSearch:
+    """预先构建的搜索索引.
+
+    拼音和英文名放在有序列表中用二分查找前缀，“省市区”中文全名建立单字和双字倒排表查找子串.
+    """
+
+    def __init__(self, locations: Sequence):
+        self._locations = locations
+        keys = []
+        self._grams: dict[str, list[int]] = {}
+        for i, loc in enumerate(locations):
+            for key in {
+                _normalize(loc.name_en),
+                _normalize(loc.adm2_en + loc.name_en),
+                pinyin_initials(loc.name_en),
+                loc.name_zh,
+            }:
+                if key:
+                    keys.append((key, i))
+            name = self._full_name_zh(loc)
+            for n in (1, 2):
+                for j in range(len(name) - n + 1):
+                    postings = self._grams.setdefault(name[j:j + n], [])
+                    if not postings or postings[-1] != i:
+                        postings.append(i)
+        keys.sort()
+        self._keys = [k for k, _ in keys]
+        self._key_rows = [i for _, i in keys]
+
+    @staticmethod
+    def _full_name_zh(loc) -> str:
+        return f"{loc.adm1_zh}{loc.adm2_zh}{loc.name_zh}"
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """返回最匹配的若干个城市."""
+        query = query.strip() if _is_cjk(query) else _normalize(query)
+        if not query:
+            return []
+        matches: dict[int, int] = {}
+        start = bisect_left(self._keys, query)
+        for pos in range(start, len(self._keys)):
+            if not (key := self._keys[pos]).startswith(query):
+                break
+            i = self._key_rows[pos]
+            kind = _EXACT if key == query else _PREFIX
+            if matches.get(i, _SUBSTRING) > kind:
+                matches[i] = kind
+        if _is_cjk(query):
+            for i in self._substring_candidates(query):
+                matches.setdefault(i, _SUBSTRING)
+
+        def rank(i):
+            loc = self._locations[i]
+            # 同等匹配时，城市本身（如北京）排在其下辖区县前
+            return matches[i], loc.name_zh != loc.adm2_zh, len(loc.name_zh), i
+
+        return [self._locations[i] for i in nsmallest(limit, matches, key=rank)]
+
+    def _substring_candidates(self, query: str) -> list[int]:
+        if len(query) == 1:
+            return self._grams.get(query, [])
+        postings = [self._grams.get(query[j:j + 2], []) for j in range(len(query) - 1)]
+        candidates = set(min(postings, key=len))
+        for p in postings:
+            candidates.intersection_update(p)
+        # 双字倒排只能保证各片段存在，需要再确认整体是子串
+        return [i for i in candidates if query in self._full_name_zh(self._locations[i])]
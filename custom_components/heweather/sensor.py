@@ -1,153 +1,286 @@
 import logging
-import re
-from datetime import timedelta
-
-# 此处引入了几个异步处理的库
-import aiohttp
+import math
+from operator import itemgetter
 
 import voluptuous as vol
 
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from homeassistant.helpers.event import async_track_time_interval
-
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.config_entries import ConfigEntry
 
-from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import (
-    ATTR_ATTRIBUTION, ATTR_FRIENDLY_NAME,
-    TEMP_CELSIUS,
-    CONCENTRATION_MICROGRAMS_PER_CUBIC_METER,
-    PERCENTAGE,
-    PRECIPITATION_MILLIMETERS_PER_HOUR,
-    SPEED_KILOMETERS_PER_HOUR,
-    PRESSURE_HPA,
-    LENGTH_KILOMETERS
+from homeassistant.components.sensor import (
+    PLATFORM_SCHEMA,
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass
 )
-from homeassistant.helpers.entity import Entity, DeviceInfo
+from homeassistant.const import ATTR_ATTRIBUTION, ATTR_FRIENDLY_NAME, MATCH_ALL, UnitOfTime
+from homeassistant.helpers.entity import DeviceInfo, EntityCategory
 import homeassistant.helpers.config_validation as cv
-import homeassistant.util.dt as dt_util
 
-from . import DOMAIN
+from . import (
+    DOMAIN, DATA_WEATHER, DATA_GRID,
+    CONF_OPTIONS, CONF_LOCATION, CONF_NAME, CONF_ID, CONF_DEADBAND, CONF_LOCATION_NAME, CONF_COMPACT,
+    entry_sites
+)
+from .coordinator import async_get_hub
+from .model import FIELDS, FIELD_INDEX
+from .grid import GRID_OPTIONS
+from .api import (
+    NOW_ENDPOINTS, FORECAST_ENDPOINTS, ENDPOINT_MINUTELY,
+    ENDPOINT_WEATHER_NOW, ENDPOINT_AIR_NOW, ENDPOINT_WARNING_NOW,
+    ENDPOINT_FORECAST_HOURLY, ENDPOINT_FORECAST_DAILY
+)
 
 _LOGGER = logging.getLogger(__name__)
 
-TIME_BETWEEN_UPDATES = timedelta(seconds=600)
-
-CONF_OPTIONS = "options"
-CONF_LOCATION = "location"
-CONF_KEY = "key"
-CONF_DISASTERLEVEL = "disasterlevel"
-CONF_DISASTERMSG = "disastermsg"
-CONF_NAME = "name"
-CONF_ID = "id"
-
-# 定义三个可选项：温度、湿度、PM2.5
+# 可选项：[类型, 名称, 图标, 设备类型, 状态类型]，单位和数据来源的接口见model.FIELDS
+# 有状态类型的数值传感器由recorder汇总为长期统计
 OPTIONS = {
-    "temprature": ["temperature", "室外温度", "mdi:thermometer", TEMP_CELSIUS],
-    "humidity": ["humidity", "室外湿度", "mdi:water-percent", PERCENTAGE],
-    "feelsLike": ["feelsLike", "体感温度", "mdi:home-thermometer", TEMP_CELSIUS],
-    "text": ["text", "天气描述", "mdi:weather-sunny", ' '],
-    "precip": ["precip", "小时降水量", "mdi:weather-rainy", PRECIPITATION_MILLIMETERS_PER_HOUR],
-    "windDir": ["windDir", "风向", "mdi:windsock", ' '],
-    "windScale": ["windScale", "风力等级", "mdi:weather-windy", ' '],
-    "windSpeed": ["windSpeed", "风速", "mdi:weather-windy", SPEED_KILOMETERS_PER_HOUR],
+    "temprature": ["temperature", "室外温度", "mdi:thermometer", SensorDeviceClass.TEMPERATURE, SensorStateClass.MEASUREMENT],
+    "humidity": ["humidity", "室外湿度", "mdi:water-percent", SensorDeviceClass.HUMIDITY, SensorStateClass.MEASUREMENT],
+    "feelsLike": ["feelsLike", "体感温度", "mdi:home-thermometer", SensorDeviceClass.TEMPERATURE, SensorStateClass.MEASUREMENT],
+    "text": ["text", "天气描述", "mdi:weather-sunny", SensorDeviceClass.ENUM, None],
+    "precip": ["precip", "小时降水量", "mdi:weather-rainy", SensorDeviceClass.PRECIPITATION_INTENSITY, SensorStateClass.MEASUREMENT],
+    "windDir": ["windDir", "风向", "mdi:windsock", SensorDeviceClass.ENUM, None],
+    "windScale": ["windScale", "风力等级", "mdi:weather-windy", None, None],
+    "windSpeed": ["windSpeed", "风速", "mdi:weather-windy", SensorDeviceClass.WIND_SPEED, SensorStateClass.MEASUREMENT],
 
     
-    "dew": ["dew", "露点温度", "mdi:thermometer-water", TEMP_CELSIUS],
-    "pressure": ["pressure", "大气压强", "mdi:car-brake-low-pressure", PRESSURE_HPA],
-    "vis": ["vis", "能见度", "mdi:eye", LENGTH_KILOMETERS],
-    "cloud": ["cloud", "云量", "mdi:weather-cloudy", PERCENTAGE],
+    "dew": ["dew", "露点温度", "mdi:thermometer-water", SensorDeviceClass.TEMPERATURE, SensorStateClass.MEASUREMENT],
+    "pressure": ["pressure", "大气压强", "mdi:car-brake-low-pressure", SensorDeviceClass.ATMOSPHERIC_PRESSURE, SensorStateClass.MEASUREMENT],
+    "vis": ["vis", "能见度", "mdi:eye", SensorDeviceClass.DISTANCE, SensorStateClass.MEASUREMENT],
+    "cloud": ["cloud", "云量", "mdi:weather-cloudy", None, SensorStateClass.MEASUREMENT],
     
     
     
-    "primary": ["primary", "空气质量的主要污染物", "mdi:face-mask", " "],
-    "category": ["category", "空气质量指数级别", "mdi:quality-high", " "],
-    "level": ["level", "空气质量指数等级", "mdi:quality-high", " "],
-    "pm25": ["pm25", "PM2.5", "mdi:grain", CONCENTRATION_MICROGRAMS_PER_CUBIC_METER],
-    "pm10": ["pm10", "PM10", "mdi:grain", CONCENTRATION_MICROGRAMS_PER_CUBIC_METER],
+    "primary": ["primary", "空气质量的主要污染物", "mdi:face-mask", None, None],
+    "category": ["category", "空气质量指数级别", "mdi:quality-high", SensorDeviceClass.ENUM, None],
+    "level": ["level", "空气质量指数等级", "mdi:quality-high", None, SensorStateClass.MEASUREMENT],
+    "pm25": ["pm25", "PM2.5", "mdi:grain", SensorDeviceClass.PM25, SensorStateClass.MEASUREMENT],
+    "pm10": ["pm10", "PM10", "mdi:grain", SensorDeviceClass.PM10, SensorStateClass.MEASUREMENT],
     
     
-    "no2": ["no2", "二氧化氮", "mdi:emoticon-dead", CONCENTRATION_MICROGRAMS_PER_CUBIC_METER],
-    "so2": ["so2", "二氧化硫", "mdi:emoticon-dead", CONCENTRATION_MICROGRAMS_PER_CUBIC_METER],
-    "co": ["co", "一氧化碳", "mdi:molecule-co", CONCENTRATION_MICROGRAMS_PER_CUBIC_METER],
-    "o3": ["o3", "臭氧", "mdi:weather-cloudy", CONCENTRATION_MICROGRAMS_PER_CUBIC_METER],
-    "qlty": ["qlty", "综合空气质量", "mdi:quality-high", " "],
-    "disaster_warn": ["disaster_warn", "灾害预警", "mdi:alert", " "],
+    "no2": ["no2", "二氧化氮", "mdi:emoticon-dead", SensorDeviceClass.NITROGEN_DIOXIDE, SensorStateClass.MEASUREMENT],
+    "so2": ["so2", "二氧化硫", "mdi:emoticon-dead", SensorDeviceClass.SULPHUR_DIOXIDE, SensorStateClass.MEASUREMENT],
+    "co": ["co", "一氧化碳", "mdi:molecule-co", None, SensorStateClass.MEASUREMENT],
+    "o3": ["o3", "臭氧", "mdi:weather-cloudy", SensorDeviceClass.OZONE, SensorStateClass.MEASUREMENT],
+    "qlty": ["qlty", "综合空气质量", "mdi:quality-high", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "disaster_warn": ["disaster_warn", "灾害预警", "mdi:alert", None, None],
+    "rain_start": ["rain_start", "几分钟后开始下雨", "mdi:weather-pouring", SensorDeviceClass.DURATION, None],
+
+    # 本地计算的指标，见derived
+    "heat_index": ["heat_index", "酷热指数", "mdi:sun-thermometer", SensorDeviceClass.TEMPERATURE, SensorStateClass.MEASUREMENT],
+    "wind_chill": ["wind_chill", "风寒温度", "mdi:snowflake-thermometer", SensorDeviceClass.TEMPERATURE, SensorStateClass.MEASUREMENT],
+    "absolute_humidity": ["absolute_humidity", "绝对湿度", "mdi:water", None, SensorStateClass.MEASUREMENT],
+    "cloud_base": ["cloud_base", "云底高度", "mdi:weather-cloudy-arrow-right", SensorDeviceClass.DISTANCE, SensorStateClass.MEASUREMENT],
+    "aqi_pm25": ["aqi_pm25", "PM2.5分指数", "mdi:grain", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "aqi_pm10": ["aqi_pm10", "PM10分指数", "mdi:grain", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "aqi_no2": ["aqi_no2", "二氧化氮分指数", "mdi:emoticon-dead", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "aqi_so2": ["aqi_so2", "二氧化硫分指数", "mdi:emoticon-dead", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "aqi_co": ["aqi_co", "一氧化碳分指数", "mdi:molecule-co", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "aqi_o3": ["aqi_o3", "臭氧分指数", "mdi:weather-cloudy", SensorDeviceClass.AQI, SensorStateClass.MEASUREMENT],
+    "sunrise": ["sunrise", "日出", "mdi:weather-sunset-up", SensorDeviceClass.TIMESTAMP, None],
+    "sunset": ["sunset", "日落", "mdi:weather-sunset-down", SensorDeviceClass.TIMESTAMP, None],
+    "moon_phase": ["moon_phase", "月相", "mdi:moon-waxing-crescent", SensorDeviceClass.ENUM, None],
 
 }
-DISASTER_LEVEL = {
-    "Missing": 0,
-    "Cancel":0,
-    "None":0,
-    "Unknown":0,
-    "Standard":1,
-    "Minor":2,
-    "Moderate":3,
-    "Major":4,
-    "Severe":5,
-    "Extreme":6
+
+# 枚举传感器的已知取值，接口返回了未知的取值时追加到末尾
+ENUM_OPTIONS = {
+    "text": [
+        "晴", "多云", "少云", "晴间多云", "阴",
+        "阵雨", "强阵雨", "雷阵雨", "强雷阵雨", "雷阵雨伴有冰雹",
+        "小雨", "中雨", "大雨", "极端降雨", "毛毛雨/细雨", "暴雨", "大暴雨", "特大暴雨", "冻雨",
+        "小到中雨", "中到大雨", "大到暴雨", "暴雨到大暴雨", "大暴雨到特大暴雨", "雨",
+        "小雪", "中雪", "大雪", "暴雪", "雨夹雪", "雨雪天气", "阵雨夹雪", "阵雪",
+        "小到中雪", "中到大雪", "大到暴雪", "雪",
+        "薄雾", "雾", "霾", "扬沙", "浮尘", "沙尘暴", "强沙尘暴", "浓雾", "强浓雾",
+        "中度霾", "重度霾", "严重霾", "大雾", "特强浓雾", "热", "冷", "未知",
+    ],
+    "windDir": ["北风", "东北风", "东风", "东南风", "南风", "西南风", "西风", "西北风", "无持续风向", "旋转风"],
+    "category": ["优", "良", "轻度污染", "中度污染", "重度污染", "严重污染"],
+    "moon_phase": [
+        "new_moon", "waxing_crescent", "first_quarter", "waxing_gibbous",
+        "full_moon", "waning_gibbous", "last_quarter", "waning_crescent",
+    ],
 }
+
 ATTR_UPDATE_TIME = "更新时间"
+ATTR_SUPPRESSED_WRITES = "跳过写入次数"
+ATTR_STALE = "数据已过期"
 ATTRIBUTION = "来自和风天气的天气数据"
 
+# 比较属性是否变化时忽略的属性
+VOLATILE_ATTRIBUTES = {ATTR_UPDATE_TIME, ATTR_SUPPRESSED_WRITES}
+
+
+# 部分类型额外的属性：{类型: ((属性名, WeatherData上的属性), ...)}
+OPTION_ATTRIBUTES = {
+    "disaster_warn": (("预警明细", "disaster_warnings"),),
+    "rain_start": (("降水概况", "minutely_summary"), ("逐5分钟降水", "minutely_forecast")),
+}
+
+# 精简模式下作为实体状态的类型，没有启用时使用启用的第一个类型
+COMPACT_PRIMARY_OPTION = "temprature"
+
+# 由内存中的历史计算的趋势：{类型: [名称后缀, 图标, FieldHistory上的属性]}，默认禁用
+TREND_SENSORS = {
+    "rate": ["3小时变化率", "mdi:trending-up", "rate"],
+    "min": ["3小时最低", "mdi:arrow-collapse-down", "minimum"],
+    "max": ["3小时最高", "mdi:arrow-collapse-up", "maximum"],
+    "mean": ["3小时平均", "mdi:chart-line-variant", "mean"],
+}
+
+# 各接口请求统计的诊断实体：{接口: [类型, 名称]}，默认禁用
+ENDPOINT_SENSORS = {
+    ENDPOINT_WEATHER_NOW: ["api_weather_now", "实况天气接口"],
+    ENDPOINT_AIR_NOW: ["api_air_now", "空气质量接口"],
+    ENDPOINT_WARNING_NOW: ["api_warning_now", "灾害预警接口"],
+    ENDPOINT_FORECAST_HOURLY: ["api_forecast_hourly", "逐小时预报接口"],
+    ENDPOINT_FORECAST_DAILY: ["api_forecast_daily", "逐天预报接口"],
+    ENDPOINT_MINUTELY: ["api_minutely", "分钟级降水接口"],
+}
+
+# 每日调用预算：[类型, 名称, 图标, 单位, 设备类型]
+QUOTA_SENSORS = {
+    "quota_remaining": ["quota_remaining", "API剩余额度", "mdi:counter", "次", None],
+    "quota_exhaustion": ["quota_exhaustion", "额度预计耗尽时间", "mdi:timer-sand", None, SensorDeviceClass.TIMESTAMP],
+}
+
+
+def parse_deadband(value) -> tuple[float, float]:
+    """解析死区配置，如"0.5"、"2%"或"0.5,2%"，返回(绝对值, 相对比例)."""
+    absolute = relative = 0.0
+    for part in filter(None, (p.strip() for p in str(value or "").split(","))):
+        if part.endswith("%"):
+            relative = float(part[:-1]) / 100
+        else:
+            absolute = float(part)
+    if not (math.isfinite(absolute) and math.isfinite(relative)) or absolute < 0 or relative < 0:
+        # nan与任何值比较都为假，会让死区永远压住状态写入
+        raise ValueError(value)
+    return absolute, relative
+
+
+def _is_significant(old, new, deadband) -> bool:
+    """数值变化超过死区（绝对值与相对比例取大者）才算显著变化，非数值只要不同即可."""
+    if old == new:
+        return False
+    try:
+        delta = abs(float(new) - float(old))
+    except (TypeError, ValueError):
+        return True
+    absolute, relative = deadband
+    return delta > max(absolute, relative * abs(float(old)))
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
     config_entry: ConfigEntry,
     async_add_entities: AddEntitiesCallback,
 ):
-    _LOGGER.info(f"setup platform Heweather, location {config_entry.data.get('location_name')}...")
-
-    location = config_entry.data.get(CONF_LOCATION)
-    name = config_entry.data.get(CONF_NAME)
-    id = config_entry.data.get(CONF_ID)
-    key = config_entry.data.get(CONF_KEY)
-    disastermsg = config_entry.data.get(CONF_DISASTERMSG)
-    disasterlevel = config_entry.data.get(CONF_DISASTERLEVEL)
-    data = WeatherData(hass, location, key, disastermsg, disasterlevel)  
-    await data.async_update(dt_util.now()) 
-    async_track_time_interval(hass, data.async_update, TIME_BETWEEN_UPDATES)
+    # 数据在__init__中创建，已从上次保存的快照恢复，后台刷新；已由其它配置项提供的位置没有数据
+    weather = hass.data[DOMAIN][config_entry.entry_id][DATA_WEATHER]
+    sites = [site for site in entry_sites(config_entry) if site[CONF_LOCATION] in weather]
+    _LOGGER.info(f"setup platform Heweather, {len(sites)} location(s) {sites[0].get(CONF_LOCATION_NAME) if sites else ''}...")
+
+    # 之前保存的无效死区（如nan）按没有死区处理
+    deadbands = {}
+    for option, value in config_entry.data.get(CONF_DEADBAND, {}).items():
+        try:
+            deadbands[option] = parse_deadband(value)
+        except ValueError:
+            _LOGGER.warning(f"Ignore invalid deadband {value!r} of {option}")
+    hub = async_get_hub(hass)
 
+    compact = config_entry.data.get(CONF_COMPACT, False)
     dev = []
-    for option in config_entry.data[CONF_OPTIONS]:
-        dev.append(HeweatherWeatherSensor(data, option, location, name, id))
-    async_add_entities(dev, True)
-
-
-class HeweatherWeatherSensor(Entity):
-    """定义一个温度传感器的类，继承自HomeAssistant的Entity类."""
-
-    def __init__(self, data, option, location, name, id):
+    for i, site in enumerate(sites):
+        location, name, id = site[CONF_LOCATION], site[CONF_NAME], site[CONF_ID]
+        data = weather[location]
+        if i == 0:
+            # 预算按key统计，fleet中只挂在第一个位置上
+            quota = hub.quota(data.key)
+            for kind in QUOTA_SENSORS:
+                dev.append(HeweatherQuotaSensor(quota, kind, location, name, id))
+        if compact:
+            # 每个位置一个实体，接口统计见诊断信息；没有启用任何类型时没有可作为状态的类型
+            if config_entry.data[CONF_OPTIONS]:
+                dev.append(HeweatherCompactSensor(data, config_entry.data[CONF_OPTIONS], location, name, id))
+            continue
+        for option in config_entry.data[CONF_OPTIONS]:
+            dev.append(HeweatherWeatherSensor(
+                data, option, location, name, id, deadbands.get(option, (0.0, 0.0))
+            ))
+        for option in data.history:
+            for kind in TREND_SENSORS:
+                dev.append(HeweatherTrendSensor(data, option, kind, location, name, id))
+        for endpoint in (*NOW_ENDPOINTS, *FORECAST_ENDPOINTS):
+            dev.append(HeweatherEndpointSensor(hub.endpoint_stats(location, endpoint), endpoint, location, name, id))
+        if data.coordinates is not None:
+            # 分钟级降水按经纬度请求，统计也按经纬度记录
+            dev.append(HeweatherEndpointSensor(
+                hub.endpoint_stats(data.coordinates, ENDPOINT_MINUTELY), ENDPOINT_MINUTELY, location, name, id
+            ))
+    # 追踪器的格点天气只提供实况天气中格点接口也有的类型
+    grid_options = [o for o in config_entry.data[CONF_OPTIONS] if o in GRID_OPTIONS]
+    for entity_id, tracker in hass.data[DOMAIN][config_entry.entry_id][DATA_GRID].items():
+        state = hass.states.get(entity_id)
+        tracker_name = state.name if state is not None else entity_id
+        for option in grid_options:
+            dev.append(HeweatherGridSensor(tracker, option, tracker_name))
+    async_add_entities(dev)
+
+
+def _device_info(location, name, id) -> DeviceInfo:
+    return DeviceInfo(
+        identifiers={(DOMAIN, location)},
+        name=name,
+        manufacturer="和风天气",
+        model=id,
+        sw_version="Web API v7免费版",
+    )
+
+
+class HeweatherWeatherSensor(SensorEntity):
+    """定义一个温度传感器的类，继承自HomeAssistant的SensorEntity类."""
+
+    def __init__(self, data, option, location, name, id, deadband=(0.0, 0.0)):
         """初始化."""
         self._data = data
         self._id = id
         self._type_name = OPTIONS[option][0]
         self._friendly_name = OPTIONS[option][1]
         self._icon = OPTIONS[option][2]
-        self._unit_of_measurement = OPTIONS[option][3]
+        self._attr_device_class = OPTIONS[option][3]
+        self._attr_state_class = OPTIONS[option][4]
+        self._attr_native_unit_of_measurement = FIELDS[option].unit
+        if option in ENUM_OPTIONS:
+            self._attr_options = list(ENUM_OPTIONS[option])
+        self._endpoint = FIELDS[option].endpoint
         self._name = name if name else location
         self._location = location
 
         self._type = option
+        # 预先取得数据项在WeatherData.values中的访问器
+        self._getter = itemgetter(FIELD_INDEX[option])
+        self._extra_attributes = OPTION_ATTRIBUTES.get(option, ())
+        self._deadband = deadband
+        self._suppressed_writes = 0
         self._state = None
         self._updatetime = None
+        self._refresh_from_data()
         self._attr_unique_id = self._type_name + location
         self._attr_has_entity_name = True
+        self._attr_should_poll = False
 
         self.entity_id = DOMAIN + "." + id + "_" + self._type_name
 
     @property
     def device_info(self) -> DeviceInfo:
         """Device info"""
-        return DeviceInfo(
-            identifiers={(DOMAIN, self._location)},
-            name=self._name,
-            manufacturer="和风天气",
-            model=self._id,
-            sw_version="Web API v7免费版",
-        )
+        return _device_info(self._location, self._name, self._id)
 
     @property
     def name(self):
@@ -155,7 +288,7 @@ class HeweatherWeatherSensor(Entity):
         return self._friendly_name
 
     @property
-    def state(self):
+    def native_value(self):
         """返回当前的状态."""
         return self._state
 
@@ -165,280 +298,335 @@ class HeweatherWeatherSensor(Entity):
         return self._icon
 
     @property
-    def unit_of_measurement(self):
-        """返回unit_of_measuremeng属性."""
-        return self._unit_of_measurement
-
-    @property
-    def device_state_attributes(self):
+    def extra_state_attributes(self):
         """设置其它一些属性值."""
         if self._state is not None:
             return {
                 ATTR_ATTRIBUTION: ATTRIBUTION,
-                ATTR_UPDATE_TIME: self._updatetime
+                ATTR_UPDATE_TIME: self._updatetime,
+                ATTR_STALE: self._endpoint in self._data.stale_endpoints,
+                ATTR_SUPPRESSED_WRITES: self._suppressed_writes,
+                **self._option_attributes()
             }
 
-    async def async_update(self):
-        """update函数变成了async_update."""
-        self._updatetime = self._data.updatetime
-        self._state = {
-            "temprature": self._data.temprature,
-            "humidity": self._data.humidity,
-            "feelsLike": self._data.feelsLike,
-            "text": self._data.text,
-            "windDir": self._data.windDir,
-            "windScale": self._data.windScale,
-            "windSpeed": self._data.windSpeed,
-            "precip": self._data.precip,
-            "pressure": self._data.pressure,
-            "vis": self._data.vis,
-            "dew": self._data.dew,
-            "cloud": self._data.cloud,
-            "category": self._data.category,
-            "primary": self._data.primary,
-            "level": self._data.level,
-            "pm10": self._data.pm10,
-            "pm25": self._data.pm25,
-            "no2": self._data.no2,
-            "so2": self._data.so2,
-            "co": self._data.co,
-            "o3": self._data.o3,
-            "qlty": self._data.qlty,
-            "disaster_warn": self._data.disaster_warn
-        }.get(self._type, None)
-
-
-
-class WeatherData(object):
-    """天气相关的数据，存储在这个类中."""
-
-    def __init__(self, hass, location, key, disastermsg, disasterlevel):
-        """初始化函数."""
-        self._hass = hass
-        self._disastermsg = disastermsg
-        self._disasterlevel = disasterlevel
-        #disastermsg, disasterlevel
-
-       # self._url = "https://free-api.heweather.com/s6/weather/now"
-        self._weather_now_url = f"https://devapi.qweather.com/v7/weather/now?location={location}&key={key}"
-        self._air_now_url = f"https://devapi.qweather.com/v7/air/now?location={location}&key={key}"
-        self._disaster_warn_url = f"https://devapi.qweather.com/v7/warning/now?location={location}&key={key}"
-        self._params = {
-            "location": location, 
-            "key": key
+    def _option_attributes(self):
+        return {name: getattr(self._data, attribute) for name, attribute in self._extra_attributes}
+
+    def _stable_attributes(self):
+        return {
+            k: v
+            for k, v in (self.extra_state_attributes or {}).items()
+            if k not in VOLATILE_ATTRIBUTES
         }
-        self._temprature = None
-        self._humidity = None
-        
-        self._feelsLike = None
-        self._text = None
-        self._windDir = None
-        self._windScale = None
-        self._windSpeed = None
-        self._precip = None
-        self._pressure = None
-        self._vis = None
-        self._cloud = None
-        self._dew = None
-        self._updatetime = None
 
-        self._category = None 
-        self._pm10 = None
-        self._primary = None
-        self._level = None
-
-        self._pm25 = None
-        self._no2 = None
-        self._so2 = None
-        self._co = None
-        self._o3 = None
-        self._qlty = None
-        self._disaster_warn = None
-        self._updatetime = None
+    async def async_added_to_hass(self):
+        """订阅所属接口的数据推送."""
+        self.async_on_remove(
+            self._data.async_add_listener(self._handle_data_update, self._endpoint)
+        )
 
-    @property
-    def temprature(self):
-        """温度."""
-        return self._temprature
+    @callback
+    def _refresh_from_data(self):
+        self._updatetime = self._data.updatetime
+        self._state = self._getter(self._data.values)
+        if self._attr_device_class == SensorDeviceClass.ENUM and self._state is not None \
+                and self._state not in self._attr_options:
+            # 枚举传感器的状态必须在options中
+            self._attr_options.append(self._state)
+
+    @callback
+    def _handle_data_update(self):
+        """接口数据更新完成后推送到这里，不再轮询.
+
+        状态和属性都没有显著变化时跳过写入，减少recorder和事件总线的负担.
+        """
+        old_state, old_attributes = self._state, self._stable_attributes()
+        self._refresh_from_data()
+        if (
+            old_state is not None
+            and not _is_significant(old_state, self._state, self._deadband)
+            and self._stable_attributes() == old_attributes
+        ):
+            # 保留上次写入的值，使缓慢漂移累积到超过死区后仍能写入
+            self._state = old_state
+            self._suppressed_writes += 1
+            self._data.suppressed_writes += 1
+            return
+        self.async_write_ha_state()
+
+
+class HeweatherCompactSensor(SensorEntity):
+    """精简模式下每个位置唯一的实体，状态为一个主要类型，其余启用的类型作为属性.
+
+    属性字典按接口预先组装并在各次写入间共用，接口更新时只改写该接口的类型；
+    属性不写入recorder，只有状态生成历史和长期统计.
+    """
+
+    _unrecorded_attributes = frozenset({MATCH_ALL})
+
+    def __init__(self, data, options, location, name, id):
+        self._data = data
+        self._location = location
+        self._name = name if name else location
+        self._id = id
+        options = [o for o in OPTIONS if o in options]
+        self._primary = COMPACT_PRIMARY_OPTION if COMPACT_PRIMARY_OPTION in options else options[0]
+        _, _, self._attr_icon, self._attr_device_class, self._attr_state_class = OPTIONS[self._primary]
+        self._attr_native_unit_of_measurement = FIELDS[self._primary].unit
+        if self._primary in ENUM_OPTIONS:
+            self._attr_options = list(ENUM_OPTIONS[self._primary])
+        self._getter = itemgetter(FIELD_INDEX[self._primary])
+        # 接口 -> [(属性名, 访问器)]，属性名为类型名，单位见对应的传感器
+        self._endpoint_attributes = {}
+        for option in options:
+            if option == self._primary:
+                continue
+            self._endpoint_attributes.setdefault(FIELDS[option].endpoint, []).append(
+                (OPTIONS[option][0], itemgetter(FIELD_INDEX[option]))
+            )
+        self._extra_attributes = {
+            FIELDS[option].endpoint: OPTION_ATTRIBUTES[option]
+            for option in options if option in OPTION_ATTRIBUTES
+        }
+        self._endpoints = {FIELDS[self._primary].endpoint, *self._endpoint_attributes, *self._extra_attributes}
+        self._attributes = {ATTR_ATTRIBUTION: ATTRIBUTION}
+        for endpoint in self._endpoints:
+            self._refresh_attributes(endpoint)
+        self._state = None
+        self._refresh_state()
+        self._attr_unique_id = "compact" + location
+        self._attr_has_entity_name = True
+        self._attr_name = None
+        self._attr_should_poll = False
+        self.entity_id = DOMAIN + "." + id
 
     @property
-    def humidity(self):
-        """湿度."""
-        return self._humidity
+    def device_info(self) -> DeviceInfo:
+        """Device info"""
+        return _device_info(self._location, self._name, self._id)
 
     @property
-    def feelsLike(self):
-        """体感温度"""
-        return self._feelsLike
+    def native_value(self):
+        return self._state
 
     @property
-    def text(self):
-        """天气状况的文字描述，包括阴晴雨雪等天气状态的描述"""
-        return self._text
-    
-    @property
-    def windDir(self):
-        """风向"""
-        return self._windDir
-    
-    @property
-    def category(self):
-        """空气质量指数级别"""
-        return self._category
-    
-    @property
-    def level(self):
-        """空气质量指数等级"""
-        return self._level
+    def extra_state_attributes(self):
+        return self._attributes
+
+    def _refresh_state(self) -> bool:
+        """取主要类型的值，返回是否有变化."""
+        old_state, self._state = self._state, self._getter(self._data.values)
+        if self._attr_device_class == SensorDeviceClass.ENUM and self._state is not None \
+                and self._state not in self._attr_options:
+            self._attr_options.append(self._state)
+        return self._state != old_state
+
+    def _refresh_attributes(self, endpoint) -> bool:
+        """改写某个接口的属性，返回是否有变化."""
+        attributes, values = self._attributes, self._data.values
+        changed = False
+        for name, getter in self._endpoint_attributes.get(endpoint, ()):
+            if attributes.get(name) != (value := getter(values)):
+                attributes[name] = value
+                changed = True
+        for name, attribute in self._extra_attributes.get(endpoint, ()):
+            if attributes.get(name) != (value := getattr(self._data, attribute)):
+                attributes[name] = value
+                changed = True
+        attributes[ATTR_UPDATE_TIME] = self._data.updatetime
+        return changed
+
+    async def async_added_to_hass(self):
+        """订阅各类型所属接口的数据推送."""
+        for endpoint in self._endpoints:
+            self.async_on_remove(self._data.async_add_listener(self._updater(endpoint), endpoint))
+
+    def _updater(self, endpoint):
+        @callback
+        def update():
+            # 两者都要刷新，不能短路
+            if self._refresh_attributes(endpoint) | self._refresh_state():
+                self.async_write_ha_state()
+            else:
+                self._data.suppressed_writes += 1
+
+        return update
+
+
+class HeweatherTrendSensor(SensorEntity):
+    """数据项在最近3小时内的变化率、最低、最高和平均值，随数据项所属的接口更新."""
+
+    def __init__(self, data, option, kind, location, name, id):
+        self._data = data
+        self._history = data.history[option]
+        self._location = location
+        self._name = name if name else location
+        self._id = id
+        field = FIELDS[option]
+        self._endpoint = field.endpoint
+        suffix, self._attr_icon, self._attribute = TREND_SENSORS[kind]
+        self._type_name = f"{OPTIONS[option][0]}_{kind}"
+        self._attr_name = OPTIONS[option][1] + suffix
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+        if kind == "rate":
+            self._attr_native_unit_of_measurement = f"{field.unit}/h" if field.unit else "/h"
+        else:
+            self._attr_native_unit_of_measurement = field.unit
+            self._attr_device_class = OPTIONS[option][3]
+        self._attr_entity_registry_enabled_default = False
+        self._attr_unique_id = self._type_name + location
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self.entity_id = DOMAIN + "." + id + "_" + self._type_name
 
     @property
-    def primary(self):
-        """空气质量的主要污染物，空气质量为优时，返回值为NA"""
-        return self._primary
-    
-    @property
-    def windScale(self):
-        """风力等级"""
-        return self._windScale
+    def device_info(self) -> DeviceInfo:
+        """Device info"""
+        return _device_info(self._location, self._name, self._id)
 
     @property
-    def windSpeed(self):
-        """风速，公里/小时"""
-        return self._windSpeed
+    def native_value(self):
+        value = getattr(self._history, self._attribute)
+        return round(value, 2) if value is not None else None
+
+    async def async_added_to_hass(self):
+        """历史在解析接口数据时已经更新，这里只写入状态."""
+        self.async_on_remove(
+            self._data.async_add_listener(self.async_write_ha_state, self._endpoint)
+        )
 
-    @property
-    def precip(self):
-        """当前小时累计降水量，默认单位：毫米"""
-        return self._precip
 
-    @property
-    def pressure(self):
-        """大气压强，默认单位：百帕"""
-        return self._pressure
-    
-    @property
-    def vis(self):
-        """能见度，默认单位：公里"""
-        return self._vis
-   
-    @property
-    def cloud(self):
-        """云量，百分比数值。可能为空"""
-        return self._cloud
+class HeweatherQuotaSensor(SensorEntity):
+    """API key每日剩余额度和预计耗尽时间，多个位置共用同一个key时数值相同."""
 
-    @property
-    def dew(self):
-        """露点温度。可能为空"""
-        return self._dew
+    def __init__(self, quota, kind, location, name, id):
+        self._quota = quota
+        self._kind = kind
+        self._location = location
+        self._name = name if name else location
+        self._id = id
+        self._type_name, self._attr_name, self._attr_icon, unit, device_class = QUOTA_SENSORS[kind]
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_unique_id = self._type_name + location
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self.entity_id = DOMAIN + "." + id + "_" + self._type_name
 
     @property
-    def pm25(self):
-        """pm2.5"""
-        return self._pm25
+    def device_info(self) -> DeviceInfo:
+        """Device info"""
+        return _device_info(self._location, self._name, self._id)
 
     @property
-    def pm10(self):
-        """pm10"""
-        return self._pm10
-    
-    @property
-    def qlty(self):
-        """(aqi)空气质量指数"""
-        return self._qlty
-    
+    def native_value(self):
+        if self._kind == "quota_remaining":
+            return self._quota.remaining
+        return self._quota.exhaustion_time()
+
     @property
-    def no2(self):
-        """no2"""
-        return self._no2
+    def extra_state_attributes(self):
+        return {
+            "每日预算": self._quota.budget,
+            "今日已用": self._quota.used
+        }
+
+    async def async_added_to_hass(self):
+        """每轮请求结束后由调度器推送."""
+        self.async_on_remove(self._quota.async_add_listener(self.async_write_ha_state))
+
+
+class HeweatherEndpointSensor(SensorEntity):
+    """某个接口的平均请求延迟，属性中是延迟分布、按状态码的次数、流量和最近成功的时间."""
+
+    def __init__(self, stats, endpoint, location, name, id):
+        self._stats = stats
+        self._location = location
+        self._name = name if name else location
+        self._id = id
+        self._type_name, self._attr_name = ENDPOINT_SENSORS[endpoint]
+        self._attr_icon = "mdi:api"
+        self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+        self._attr_device_class = SensorDeviceClass.DURATION
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_entity_registry_enabled_default = False
+        self._attr_unique_id = self._type_name + location
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self.entity_id = DOMAIN + "." + id + "_" + self._type_name
 
     @property
-    def co(self):
-        """co"""
-        return self._co
-    
+    def device_info(self) -> DeviceInfo:
+        """Device info"""
+        return _device_info(self._location, self._name, self._id)
+
     @property
-    def so2(self):
-        """so2"""
-        return self._so2
-    
+    def native_value(self):
+        latency = self._stats.mean_latency
+        return round(latency, 1) if latency is not None else None
+
     @property
-    def o3(self):
-        """o3"""
-        return self._o3
-    
+    def extra_state_attributes(self):
+        stats = self._stats.as_dict()
+        return {
+            "p50": stats["p50_ms"],
+            "p95": stats["p95_ms"],
+            "延迟分布": stats["histogram_ms"],
+            "请求次数": stats["count"],
+            "状态码": stats["codes"],
+            "流量": stats["bytes"],
+            "今日调用": stats["calls_today"],
+            "上次成功": stats["last_success"],
+            "距上次成功": stats["seconds_since_success"],
+            "上次失败": stats["last_error"],
+        }
+
+    async def async_added_to_hass(self):
+        """每次实际发出的请求完成后写入."""
+        self.async_on_remove(self._stats.async_add_listener(self.async_write_ha_state))
+
+
+class HeweatherGridSensor(SensorEntity):
+    """移动的追踪器所在网格的格点天气，网格变化或定时刷新时更新."""
+
+    def __init__(self, tracker, option, tracker_name):
+        self._tracker = tracker
+        self._option = option
+        self._object_id = tracker.entity_id.split(".", 1)[1]
+        self._tracker_name = tracker_name
+        self._type_name, self._attr_name, self._attr_icon, self._attr_device_class, self._attr_state_class = OPTIONS[option]
+        self._attr_native_unit_of_measurement = FIELDS[option].unit
+        if option in ENUM_OPTIONS:
+            self._attr_options = list(ENUM_OPTIONS[option])
+        self._attr_unique_id = "grid_" + self._type_name + tracker.entity_id
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self.entity_id = DOMAIN + ".grid_" + self._object_id + "_" + self._type_name
+
     @property
-    def disaster_warn(self):
-        """灾害预警"""
-        return self._disaster_warn
-    
-    
+    def device_info(self) -> DeviceInfo:
+        """Device info"""
+        return _device_info("grid_" + self._tracker.entity_id, f"{self._tracker_name}格点天气", self._object_id)
+
     @property
-    def updatetime(self):
-        """更新时间."""
-        return self._updatetime
+    def native_value(self):
+        value = self._tracker.values.get(self._option)
+        if self._attr_device_class == SensorDeviceClass.ENUM and value is not None \
+                and value not in self._attr_options:
+            self._attr_options.append(value)
+        return value
 
-    async def async_update(self, now=""):
-        """从远程更新信息."""
-        _LOGGER.info(f"Update for location {self._params['location']} from HeFeng API...")
+    @property
+    def extra_state_attributes(self):
+        return {
+            ATTR_ATTRIBUTION: ATTRIBUTION,
+            ATTR_UPDATE_TIME: self._tracker.updatetime,
+            "追踪器": self._tracker.entity_id,
+            "网格": self._tracker.cell,
+        }
 
-        # 通过HTTP访问，获取需要的信息
-        # 此处使用了基于aiohttp库的async_get_clientsession
-        try:
-            timeout = aiohttp.ClientTimeout(total=20)  
-            connector = aiohttp.TCPConnector(limit=10)  
-            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-                async with session.get(self._weather_now_url) as response:
-                    if (json_data := await response.json())["code"] == "401":
-                        raise PermissionError()
-                    weather = json_data["now"]
-                async with session.get(self._air_now_url) as response:
-                    air = (await response.json())["now"]
-                async with session.get(self._disaster_warn_url) as response:
-                    disaster_warn = (await response.json())["warning"]
-        except(aiohttp.ClientError) as e:
-            _LOGGER.error("Error while accessing: %s", self._weather_now_url)
-            raise ConnectionError()
-
-        # 根据http返回的结果，更新数据
-        self._temprature = weather["temp"]
-        self._humidity = weather["humidity"]
-        
-        self._feelsLike = weather["feelsLike"]
-        self._text = weather["text"]
-        self._windDir = weather["windDir"]
-        self._windScale = weather["windScale"]
-        self._windSpeed = weather["windSpeed"]
-        self._precip = weather["precip"]
-        self._pressure = weather["pressure"]
-        self._vis = weather["vis"]
-        self._cloud = weather["cloud"]
-        self._dew = weather["dew"]
-        self._updatetime = weather["obsTime"]
-
-        self._category = air["category"]
-        self._pm25 = air["pm2p5"]
-        self._pm10 = air["pm10"]
-        self._primary = air["primary"]
-        self._level = air["level"]
-
-        self._no2 = air["no2"]
-        self._so2 = air["so2"]
-        self._co = air["co"]
-        self._o3 = air["o3"]
-        self._qlty = air["aqi"]
-        
-        allmsg = []
-        titlemsg = []
-        for i in disaster_warn:
-            #if DISASTER_LEVEL[i["severity"]] >= 订阅等级:
-            if DISASTER_LEVEL.get(i["severity"], 0) >= int(self._disasterlevel):
-                titlemsg.append(simple_title := re.search(r"发布(.*?)$", i["title"]).group(1)) 
-                allmsg.append(f'{simple_title}-{i["text"]}')
-
-        if len(titlemsg) == 0:
-            self._disaster_warn = f'近日无{self._disasterlevel}级及以上灾害'  
-        #if(订阅标题)
-        elif self._disastermsg == 'title':
-            self._disaster_warn = "#".join(titlemsg)[:255]
-        else:
-            self._disaster_warn = "#".join(allmsg)[:255]
\ No newline at end of file
+    async def async_added_to_hass(self):
+        """追踪器拿到新的格点数据后写入."""
+        self.async_on_remove(self._tracker.async_add_listener(self.async_write_ha_state))
@@ -0,0 +1,76 @@
+"""按经纬度查找最近城市的KD树."""
+from __future__ import annotations
+
+import heapq
+import math
+from collections.abc import Sequence
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _to_xyz(lat: float, lon: float) -> tuple[float, float, float]:
+    # 转换为单位球面上的三维坐标，弦长与球面距离单调对应，避免经度在高纬度和180度处失真
+    lat, lon = math.radians(lat), math.radians(lon)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def _chord_to_km(chord_sq: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+
+class LocationTree:
+    """城市坐标的KD树，构建一次后查询为O(log n).
+
+    节点按层依次以x、y、z轴切分，存放在平铺的列表中.
+    """
+
+    def __init__(self, locations: Sequence):
+        self._locations = locations
+        points = [
+            (_to_xyz(loc.lat, loc.lon), i)
+            for i, loc in enumerate(locations)
+            if loc.lat is not None and loc.lon is not None
+        ]
+        # 节点：(坐标, 城市序号, 左子树, 右子树)
+        self._nodes: list[tuple] = []
+        self._root = self._build(points, 0)
+
+    def _build(self, points: list, depth: int) -> int:
+        if not points:
+            return -1
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        node = len(self._nodes)
+        self._nodes.append(None)
+        left = self._build(points[:mid], depth + 1)
+        right = self._build(points[mid + 1:], depth + 1)
+        self._nodes[node] = (points[mid][0], points[mid][1], left, right)
+        return node
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list[tuple[object, float]]:
+        """返回最近的k个城市及其距离（公里），按距离排序."""
+        target = _to_xyz(lat, lon)
+        # 大顶堆，保存当前最近的k个：(-距离平方, 城市序号)
+        best: list[tuple[float, int]] = []
+        # (节点, 深度, 到该子树切分面距离的平方)
+        stack = [(self._root, 0, 0.0)]
+        while stack:
+            node, depth, bound_sq = stack.pop()
+            # 切分面比当前第k近更远时不用再查这一侧
+            if node < 0 or (len(best) == k and bound_sq >= -best[0][0]):
+                continue
+            point, i, left, right = self._nodes[node]
+            dist_sq = sum((a - b) ** 2 for a, b in zip(point, target))
+            if len(best) < k:
+                heapq.heappush(best, (-dist_sq, i))
+            elif dist_sq < -best[0][0]:
+                heapq.heapreplace(best, (-dist_sq, i))
+            diff = target[depth % 3] - point[depth % 3]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, depth + 1, diff * diff))
+            stack.append((near, depth + 1, 0.0))
+        return [
+            (self._locations[i], _chord_to_km(-neg_dist_sq))
+            for neg_dist_sq, i in sorted(best, reverse=True)
+        ]
@@ -0,0 +1,104 @@
+"""每个位置、每个接口的请求统计，不开调试日志也能发现慢接口和额度消耗."""
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Callable
+from typing import Any
+
+from homeassistant.core import CALLBACK_TYPE, callback
+import homeassistant.util.dt as dt_util
+
+# 延迟分布的桶上限（毫秒），超过最后一个的计入溢出桶
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# 请求没有拿到接口状态码时使用的代码
+CODE_TIMEOUT = "timeout"
+CODE_CLIENT_ERROR = "client_error"
+
+
+class EndpointStats:
+    """请求延迟的分布、按状态码的次数、流量、最近一次成功的时间和今日的调用次数."""
+
+    __slots__ = (
+        "buckets", "count", "latency_sum", "codes", "bytes", "last_success",
+        "last_error", "calls_today", "_day", "_listeners"
+    )
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.codes: Counter[str] = Counter()
+        self.bytes = 0
+        self.last_success: float | None = None
+        self.last_error: tuple[float, str] | None = None
+        self.calls_today = 0
+        self._day = dt_util.now().date()
+        self._listeners: list[CALLBACK_TYPE] = []
+
+    @callback
+    def record(self, latency: float, code: str, size: int = 0) -> None:
+        """记录一次实际发出的请求，latency单位为秒."""
+        latency_ms = latency * 1000
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.count += 1
+        self.latency_sum += latency_ms
+        self.codes[code] += 1
+        self.bytes += size
+        if (today := dt_util.now().date()) != self._day:
+            self._day = today
+            self.calls_today = 0
+        self.calls_today += 1
+        if code == "200":
+            self.last_success = time.time()
+        else:
+            self.last_error = (time.time(), code)
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    @property
+    def mean_latency(self) -> float | None:
+        return self.latency_sum / self.count if self.count else None
+
+    def percentile(self, q: float) -> float | None:
+        """按延迟分布估计的分位数，取所在桶的上限（毫秒）；落在溢出桶时上限未知，返回None."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def seconds_since_success(self) -> float | None:
+        return time.time() - self.last_success if self.last_success is not None else None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_latency_ms": self.mean_latency,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "histogram_ms": {
+                **{f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                f">{LATENCY_BUCKETS_MS[-1]}": self.buckets[-1],
+            },
+            "codes": dict(self.codes),
+            "bytes": self.bytes,
+            "calls_today": self.calls_today,
+            "last_success": dt_util.utc_from_timestamp(self.last_success).isoformat() if self.last_success else None,
+            "seconds_since_success": self.seconds_since_success(),
+            "last_error": {
+                "time": dt_util.utc_from_timestamp(self.last_error[0]).isoformat(),
+                "code": self.last_error[1],
+            } if self.last_error else None,
+        }
+
+    @callback
+    def async_add_listener(self, update_callback: CALLBACK_TYPE) -> Callable[[], None]:
+        self._listeners.append(update_callback)
+        return lambda: self._listeners.remove(update_callback)
@@ -0,0 +1,83 @@
+"""灾害预警的增量处理."""
+from __future__ import annotations
+
+import re
+from typing import Any
+
+EVENT_WARNING = "heweather_warning"
+
+WARNING_NEW = "new"
+WARNING_UPDATED = "updated"
+WARNING_CANCELLED = "cancelled"
+
+DISASTER_LEVEL = {
+    "Missing": 0,
+    "Cancel":0,
+    "None":0,
+    "Unknown":0,
+    "Standard":1,
+    "Minor":2,
+    "Moderate":3,
+    "Major":4,
+    "Severe":5,
+    "Extreme":6
+}
+
+# 预警内容变化时才算更新的字段
+_COMPARED_FIELDS = ("severity", "status", "text", "endTime", "type")
+
+_TITLE_PATTERN = re.compile(r"发布(.*?)$")
+
+
+def _parse(warning: dict[str, Any]) -> dict[str, Any]:
+    title = warning.get("title", "")
+    # 如"北京市气象台发布暴雨蓝色预警" -> "暴雨蓝色预警"
+    simple_title = m.group(1) if (m := _TITLE_PATTERN.search(title)) else title
+    return {
+        "id": warning["id"],
+        "title": title,
+        "simple_title": simple_title,
+        "level": DISASTER_LEVEL.get(warning.get("severity"), 0),
+        **{k: warning.get(k) for k in (
+            "sender", "pubTime", "startTime", "endTime", "status", "severity",
+            "severityColor", "type", "typeName", "urgency", "certainty", "text", "related"
+        )},
+    }
+
+
+class WarningTracker:
+    """按预警id保存当前有效的预警，每轮只解析新出现或内容变化的预警."""
+
+    def __init__(self, min_level: int):
+        self._min_level = min_level
+        self._active: dict[str, dict[str, Any]] = {}
+        self._raw: dict[str, tuple] = {}
+
+    @property
+    def active(self) -> list[dict[str, Any]]:
+        """当前有效的预警，按发布顺序."""
+        return list(self._active.values())
+
+    def update(self, warnings: list[dict[str, Any]]) -> list[tuple[str, dict[str, Any]]]:
+        """用接口返回的预警列表更新，返回变化：[(new/updated/cancelled, 预警)]."""
+        changes = []
+        seen = set()
+        for warning in warnings:
+            if warning.get("status") == "cancel" or DISASTER_LEVEL.get(warning.get("severity"), 0) < self._min_level:
+                continue
+            seen.add(warning_id := warning["id"])
+            raw = tuple(warning.get(k) for k in _COMPARED_FIELDS)
+            if self._raw.get(warning_id) == raw:
+                continue
+            kind = WARNING_UPDATED if warning_id in self._active else WARNING_NEW
+            if kind == WARNING_NEW and (related := warning.get("related")) in self._active:
+                # 更新后的预警使用新的id，related指向被更新的预警
+                kind = WARNING_UPDATED
+                del self._active[related], self._raw[related]
+            self._raw[warning_id] = raw
+            self._active[warning_id] = parsed = _parse(warning)
+            changes.append((kind, parsed))
+        for warning_id in [i for i in self._active if i not in seen]:
+            del self._raw[warning_id]
+            changes.append((WARNING_CANCELLED, self._active.pop(warning_id)))
+        return changes
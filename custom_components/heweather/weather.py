@@ -0,0 +1,209 @@
+"""和风天气的天气实体，提供实况和逐小时、逐天预报."""
+from __future__ import annotations
+
+import logging
+
+from homeassistant.components.weather import (
+    ATTR_CONDITION_CLEAR_NIGHT,
+    ATTR_CONDITION_CLOUDY,
+    ATTR_CONDITION_EXCEPTIONAL,
+    ATTR_CONDITION_FOG,
+    ATTR_CONDITION_HAIL,
+    ATTR_CONDITION_LIGHTNING_RAINY,
+    ATTR_CONDITION_PARTLYCLOUDY,
+    ATTR_CONDITION_POURING,
+    ATTR_CONDITION_RAINY,
+    ATTR_CONDITION_SNOWY,
+    ATTR_CONDITION_SNOWY_RAINY,
+    ATTR_CONDITION_SUNNY,
+    Forecast,
+    WeatherEntity,
+    WeatherEntityFeature,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import (
+    UnitOfLength,
+    UnitOfPrecipitationDepth,
+    UnitOfPressure,
+    UnitOfSpeed,
+    UnitOfTemperature,
+)
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from . import DOMAIN, DATA_WEATHER, CONF_LOCATION, CONF_NAME, CONF_ID, entry_sites
+from .api import ENDPOINT_WEATHER_NOW, ENDPOINT_FORECAST_HOURLY, ENDPOINT_FORECAST_DAILY
+from .sensor import ATTRIBUTION, _device_info
+
+_LOGGER = logging.getLogger(__name__)
+
+# 和风天气图标代码 -> HomeAssistant的天气状况，未列出的代码按区间归类
+CONDITION_BY_ICON = {
+    "100": ATTR_CONDITION_SUNNY,
+    "150": ATTR_CONDITION_CLEAR_NIGHT,
+    "101": ATTR_CONDITION_CLOUDY,
+    "151": ATTR_CONDITION_CLOUDY,
+    "102": ATTR_CONDITION_PARTLYCLOUDY,
+    "152": ATTR_CONDITION_PARTLYCLOUDY,
+    "103": ATTR_CONDITION_PARTLYCLOUDY,
+    "153": ATTR_CONDITION_PARTLYCLOUDY,
+    "104": ATTR_CONDITION_CLOUDY,
+    "302": ATTR_CONDITION_LIGHTNING_RAINY,
+    "303": ATTR_CONDITION_LIGHTNING_RAINY,
+    "304": ATTR_CONDITION_HAIL,
+    "307": ATTR_CONDITION_POURING,
+    "308": ATTR_CONDITION_POURING,
+    "310": ATTR_CONDITION_POURING,
+    "311": ATTR_CONDITION_POURING,
+    "312": ATTR_CONDITION_POURING,
+    "313": ATTR_CONDITION_SNOWY_RAINY,
+    "404": ATTR_CONDITION_SNOWY_RAINY,
+    "405": ATTR_CONDITION_SNOWY_RAINY,
+    "406": ATTR_CONDITION_SNOWY_RAINY,
+    "456": ATTR_CONDITION_SNOWY_RAINY,
+    "900": ATTR_CONDITION_EXCEPTIONAL,
+    "901": ATTR_CONDITION_EXCEPTIONAL,
+}
+
+# 预报的更新分别通知对应类型的订阅
+FORECAST_TYPES = {
+    ENDPOINT_FORECAST_HOURLY: "hourly",
+    ENDPOINT_FORECAST_DAILY: "daily",
+}
+FORECAST_ENDPOINTS = {forecast_type: endpoint for endpoint, forecast_type in FORECAST_TYPES.items()}
+
+
+def condition_from_icon(icon: str | None) -> str | None:
+    if icon is None:
+        return None
+    if (condition := CONDITION_BY_ICON.get(icon)) is not None:
+        return condition
+    if icon.startswith("3"):
+        return ATTR_CONDITION_RAINY
+    if icon.startswith("4"):
+        return ATTR_CONDITION_SNOWY
+    if icon.startswith("5"):
+        return ATTR_CONDITION_FOG
+    return None
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+):
+    weather = hass.data[DOMAIN][config_entry.entry_id][DATA_WEATHER]
+    async_add_entities([
+        HeweatherWeather(weather[site[CONF_LOCATION]], site[CONF_LOCATION], site[CONF_NAME], site[CONF_ID])
+        for site in entry_sites(config_entry) if site[CONF_LOCATION] in weather
+    ])
+
+
+class HeweatherWeather(WeatherEntity):
+    """实况取自weather/now，预报按需从WeatherData中组装，不写入状态属性."""
+
+    _attr_has_entity_name = True
+    _attr_name = None
+    _attr_should_poll = False
+    _attr_attribution = ATTRIBUTION
+    _attr_supported_features = WeatherEntityFeature.FORECAST_HOURLY | WeatherEntityFeature.FORECAST_DAILY
+    _attr_native_temperature_unit = UnitOfTemperature.CELSIUS
+    _attr_native_pressure_unit = UnitOfPressure.HPA
+    _attr_native_wind_speed_unit = UnitOfSpeed.KILOMETERS_PER_HOUR
+    _attr_native_visibility_unit = UnitOfLength.KILOMETERS
+    _attr_native_precipitation_unit = UnitOfPrecipitationDepth.MILLIMETERS
+
+    def __init__(self, data, location, name, id):
+        self._data = data
+        self._location = location
+        self._name = name if name else location
+        self._id = id
+        self._attr_unique_id = "weather" + location
+        self.entity_id = "weather." + id
+
+    @property
+    def device_info(self):
+        return _device_info(self._location, self._name, self._id)
+
+    @property
+    def condition(self):
+        return condition_from_icon(self._data.get("icon"))
+
+    @property
+    def native_temperature(self):
+        return self._data.get("temprature")
+
+    @property
+    def native_apparent_temperature(self):
+        return self._data.get("feelsLike")
+
+    @property
+    def humidity(self):
+        return self._data.get("humidity")
+
+    @property
+    def native_pressure(self):
+        return self._data.get("pressure")
+
+    @property
+    def native_wind_speed(self):
+        return self._data.get("windSpeed")
+
+    @property
+    def wind_bearing(self):
+        return self._data.get("wind360")
+
+    @property
+    def native_visibility(self):
+        return self._data.get("vis")
+
+    @property
+    def cloud_coverage(self):
+        return self._data.get("cloud")
+
+    @property
+    def native_dew_point(self):
+        return self._data.get("dew")
+
+    def _forecast(self, endpoint) -> list[Forecast] | None:
+        # 被读取过的预报才会继续请求，见WeatherData.forecast_wanted
+        self._data.async_forecast_read(endpoint)
+        if (forecast := self._data.forecast(endpoint)) is None:
+            return None
+        for item in forecast:
+            item["condition"] = condition_from_icon(item.pop("icon"))
+        return forecast
+
+    async def async_forecast_hourly(self) -> list[Forecast] | None:
+        return self._forecast(ENDPOINT_FORECAST_HOURLY)
+
+    async def async_forecast_daily(self) -> list[Forecast] | None:
+        return self._forecast(ENDPOINT_FORECAST_DAILY)
+
+    @callback
+    def _async_subscription_started(self, forecast_type) -> None:
+        """有前端或其它集成订阅预报时才按间隔请求该级预报."""
+        if (endpoint := FORECAST_ENDPOINTS.get(forecast_type)) is not None:
+            self._data.async_forecast_subscribed(endpoint, 1)
+
+    @callback
+    def _async_subscription_ended(self, forecast_type) -> None:
+        if (endpoint := FORECAST_ENDPOINTS.get(forecast_type)) is not None:
+            self._data.async_forecast_subscribed(endpoint, -1)
+
+    async def async_added_to_hass(self):
+        """实况更新时写入状态，预报更新时只通知预报的订阅者."""
+        self.async_on_remove(
+            self._data.async_add_listener(self.async_write_ha_state, ENDPOINT_WEATHER_NOW)
+        )
+        for endpoint, forecast_type in FORECAST_TYPES.items():
+            self.async_on_remove(self._data.async_add_listener(
+                self._forecast_listener(forecast_type), endpoint
+            ))
+
+    def _forecast_listener(self, forecast_type):
+        @callback
+        def forecast_updated():
+            self.hass.async_create_task(self.async_update_listeners((forecast_type,)))
+
+        return forecast_updated